@@ -44,6 +44,10 @@ db.createCollection('experiments', {
                     bsonType: 'date',
                     description: 'must be a date and is required',
                 },
+                stop: {
+                    bsonType: 'date',
+                    description: 'must be a date, set when the experiment is stopped',
+                },
 
                 cameraReference: {
                     bsonType: 'array',
@@ -63,7 +67,11 @@ print('Experiments collection created');
 ////////// SENSOR TIMESERIES //////////
 ///////////////////////////////////////
 
-// Camera
+// Sensor samples are stored in the native time-series collection 'sensor_data'
+// (timeField 'timestamp', metaField 'meta' with experiment and sensor id), created by the API migrations
+
+// Camera (legacy), depth frames are stored compressed as BSON Binary in 'depth_frames'
+// or in the 'depth_frames_fs' GridFS bucket, created by the API migrations
 db.createCollection('camera', {
     validator: {
         $jsonSchema: {
@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 
 # Import general libraries
-import logging, os, sys
+import logging, os, sys, math, json, functools, shutil, tempfile
 import asyncio
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
 from aiohttp import web
+from pymongo.errors import PyMongoError, DuplicateKeyError
+from bson import ObjectId
+from bson.errors import InvalidId
 
 # Import local libraries
 from migrations.migrate import MigrationsManager
+from dal.dal import SampleDecoder, SampleDecodeError, SampleEncoder, EXPORT_FORMATS, FrameDecoder, FrameDecodeError, FRAME_DTYPES, parse_iso_timestamp
+from dal.mogo import MongoDAL
+from dal.cache import ResultCache
+from dal.health import DBHealthProbe
+from sal.sal import SensorRegistry
+from sal.realsense import RealSenseSensor
+from sal.broadcast import Broadcaster
+from sal.merge import StreamMerger, asof_join
+from metrics.metrics import MetricsRegistry
+from server.prefork import PreforkServer
+from server.peers import WorkerPeers
 
 #############################################################################################################################
 ####################################################### ENV VARIABLES #######################################################
@@ -16,6 +31,8 @@ from migrations.migrate import MigrationsManager
 # API configuration
 API_CONFIG = os.getenv("API_CONFIG")
 URL_PREFIX = str(os.getenv("API_PREFIX"))
+# Number of worker processes sharing the listening socket, 1 serves from a single process
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
 
 # DB configuration
 DB_CONNECTION_STRING = str(os.getenv("API_DB_CONNECTION_STRING"))
@@ -23,6 +40,27 @@ DB_MIN_POOL_SIZE = int(os.getenv("API_DB_MIN_POOL_SIZE"))
 DB_MAX_POOL_SIZE = int(os.getenv("API_DB_MAX_POOL_SIZE"))
 DB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("API_DB_SERVER_SELECTION_TIMEOUT_MS"))
 DB_MAX_IDLE_TIME_MS = int(os.getenv("API_DB_MAX_IDLE_TIME_MS"))
+DB_HEALTH_INTERVAL_S = float(os.getenv("API_DB_HEALTH_INTERVAL_S", "5"))
+
+# Ingest configuration
+INGEST_BATCH_SIZE = int(os.getenv("API_INGEST_BATCH_SIZE", "1000"))
+
+# Export configuration, documents per cursor round-trip and bytes per response chunk
+EXPORT_BATCH_SIZE = int(os.getenv("API_EXPORT_BATCH_SIZE", "5000"))
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+# Depth frame configuration, compressed frames larger than the threshold in KB are stored in GridFS
+FRAME_GRIDFS_THRESHOLD_KB = int(os.getenv("API_FRAME_GRIDFS_THRESHOLD_KB", "4096"))
+FRAME_CHUNK_SIZE = 64 * 1024
+
+# Size of the result cache of completed experiments in MB
+CACHE_SIZE_MB = int(os.getenv("API_CACHE_SIZE_MB", "64"))
+
+# Live broadcasting configuration, messages queued per WebSocket client before the oldest ones are dropped
+BROADCAST_QUEUE_SIZE = int(os.getenv("API_BROADCAST_QUEUE_SIZE", "32"))
+
+# Sensor configuration (JSON list of {"type": ..., "id": ..., "options": {...}})
+SENSORS_CONFIG = os.getenv("API_SENSORS", "[]")
 
 ###############################################################################################################################
 ######################################################### API MANAGER #########################################################
@@ -33,25 +71,44 @@ class APIManager():
         API Manager for managing the API server
     """
 
-    # Initialize API
-    async def initialize_api(self):
+    # Initialize API, workers of a multi-process server skip the migrations already run by the master
+    # and are linked to the other num_workers - 1 workers over the Unix sockets in socket_dir
+    async def initialize_api(self, migrate=True, sensors_config=SENSORS_CONFIG, worker=None, num_workers=1, socket_dir=None):
 
-        # Create the migrate object and execute migrations if necessary
-        migrations = MigrationsManager(DB_CONNECTION_STRING)
-        
         # Try to migrate DB
-        if await migrations.migrate():
-            log.info("## DB migration successfull ##")
-        else:
-            log.error("!! DB migration failed !!")
-            sys.exit(1)
+        if migrate:
+            await self.migrate_db()
 
         log.info("## Initializing API server ##")
 
-        self.subapp = web.Application()
+        # Requests are counted and timed by the metrics middleware, DB commands and pool events by the driver listeners
+        self.metrics = MetricsRegistry(worker)
+        self.subapp = web.Application(middlewares=[self.metrics.middleware])
+        self.subapp['metrics'] = self.metrics
 
         log.info("## Configuring Motor driver for MongoDB... ##")
         self.subapp['db_client'] = await self.setup_db()
+        self.subapp['dal'] = MongoDAL(self.subapp['db_client'])
+        self.subapp['result_cache'] = ResultCache(CACHE_SIZE_MB * 1024 * 1024)
+        self.subapp['db_probe'] = DBHealthProbe(self.subapp['db_client'], DB_HEALTH_INTERVAL_S)
+        self.subapp.on_startup.append(self.start_db_probe)
+        self.subapp.on_cleanup.append(self.stop_db_probe)
+
+        log.info("## Configuring sensors... ##")
+        self.subapp['sensors'] = SensorRegistry.from_config(sensors_config)
+        self.subapp.on_startup.append(self.start_sensors)
+        self.subapp.on_cleanup.append(self.stop_sensors)
+
+        log.info("## Configuring live broadcasting... ##")
+        self.subapp['broadcaster'] = Broadcaster(BROADCAST_QUEUE_SIZE)
+        self.subapp.on_shutdown.append(self.close_broadcaster)
+
+        # Workers relay broadcasts, sensor requests and metrics scrapes between each other
+        if worker is not None:
+            log.info("## Configuring links to {} other workers... ##".format(num_workers - 1))
+            self.subapp['peers'] = WorkerPeers(worker, num_workers, socket_dir, URL_PREFIX, self.subapp['broadcaster'])
+            self.subapp.on_startup.append(self.subapp['peers'].start)
+            self.subapp.on_cleanup.append(self.subapp['peers'].close)
 
         log.info("## Adding routes to application object... ##")
         self.subapp.router.add_routes(self.routes)
@@ -62,6 +119,17 @@ class APIManager():
 
         log.info("## API initialization complete ##")
 
+    # Execute migrations if necessary
+    async def migrate_db(self):
+        # Create the migrate object
+        migrations = MigrationsManager(DB_CONNECTION_STRING)
+
+        if await migrations.migrate():
+            log.info("## DB migration successfull ##")
+        else:
+            log.error("!! DB migration failed !!")
+            sys.exit(1)
+
     # Setup DB connection
     async def setup_db(self):
         # Configure the Motor driver for MongoDB
@@ -72,14 +140,125 @@ class APIManager():
                                     maxIdleTimeMS=DB_MAX_IDLE_TIME_MS,
                                     appname="Rainsim-API",
                                     retryWrites=True,
-                                    retryReads=True)
+                                    retryReads=True,
+                                    event_listeners=self.metrics.listeners())
         return client
 
+    # Start the background DB health probe when the server starts
+    async def start_db_probe(self, app):
+        log.info("## Starting DB health probe every {} s... ##".format(DB_HEALTH_INTERVAL_S))
+        app['db_probe'].start()
+
+    async def stop_db_probe(self, app):
+        log.info("## Stopping DB health probe... ##")
+        await app['db_probe'].stop()
+
+    # Start sensors when the server starts
+    async def start_sensors(self, app):
+        log.info("## Starting {} sensors... ##".format(len(app['sensors'])))
+        await app['sensors'].start_all()
+        app['sensor_forwarders'] = [asyncio.create_task(self.forward_sensor(app, sensor)) for sensor in app['sensors']]
+        app['sensor_forwarders'].extend(asyncio.create_task(self.ingest_sensor(app, sensor)) for sensor in app['sensors']
+                                        if getattr(sensor, 'ingest_experiment', None) is not None)
+
+    # Stop sensors when the server stops
+    async def stop_sensors(self, app):
+        log.info("## Stopping sensors... ##")
+        for task in app.get('sensor_forwarders', []):
+            task.cancel()
+        await app['sensors'].stop_all()
+
+    # Broadcast the scalar samples of a sensor to the live/<sensor_id> topic
+    async def forward_sensor(self, app, sensor):
+        broadcaster = app['broadcaster']
+        topic = "live/{}".format(sensor.sensor_id)
+        async for batch in sensor.batches():
+            if broadcaster.has_subscribers(topic) and isinstance(batch[0].value, (int, float)):
+                broadcaster.publish(topic, [[sample.timestamp, sample.value] for sample in batch])
+
+    # Store the samples of a simulated sensor like a client posting them to the ingest route, the samples of every
+    # INGEST_BATCH_SIZE samples or second are encoded as NDJSON and go through the same decoder and batched inserts
+    async def ingest_sensor(self, app, sensor):
+        experiment = sensor.ingest_experiment
+        dal = app['dal']
+        metrics = app['metrics']
+        broadcast = APIManager.ingest_broadcaster(app, experiment, sensor.sensor_id)
+        loop = asyncio.get_running_loop()
+        log.info("## Ingesting the samples of sensor {} into experiment {} ##".format(sensor.sensor_id, experiment))
+
+        async def body(lines):
+            yield "".join(lines).encode()
+
+        created = False
+        lines = []
+        since = loop.time()
+        async for batch in sensor.batches():
+            lines.extend("[{!r}, {!r}]\n".format(sample.timestamp, sample.value) for sample in batch)
+            if len(lines) < INGEST_BATCH_SIZE and loop.time() - since < 1.0:
+                continue
+            since = loop.time()
+
+            # Samples that cannot be stored are dropped, the simulation keeps its rate like a real sensor
+            decoder = SampleDecoder(experiment, sensor.sensor_id, "ndjson")
+            try:
+                if not created:
+                    try:
+                        await dal.create_experiment(experiment, "Simulated sensor ingest")
+                    except DuplicateKeyError:
+                        pass
+                    created = True
+                batches = await dal.ingest(decoder, body(lines), INGEST_BATCH_SIZE, on_batch=broadcast)
+            except (PyMongoError, SampleDecodeError) as e:
+                log.error("!! Ingest for {}/{} failed with error: {} !!".format(experiment, sensor.sensor_id, e))
+                lines = []
+                continue
+            lines = []
+            metrics.ingest_received.inc(amount=decoder.num_samples)
+            metrics.ingest_inserted.inc(amount=sum(batch["inserted"] for batch in batches))
+            metrics.ingest_batches.inc(amount=len(batches))
+
+    # Close the WebSocket clients so the server does not wait for them on shutdown
+    async def close_broadcaster(self, app):
+        log.info("## Closing {} WebSocket clients... ##".format(len(app['broadcaster'].clients)))
+        await app['broadcaster'].close()
+
     # Run API
     def run_api(self, host, port, loop):
         log.info("## Server starting on address: http://{}:{} ##".format(host, port))
         web.run_app(self.app, host=host, port=port, loop=loop)
 
+    # Run API in worker processes sharing one listening socket, the master runs the migrations once
+    # Sensors are hardware owned by one process, only worker 0 starts them and the other workers forward sensor requests to it
+    def run_api_workers(self, host, port, num_workers):
+        asyncio.run(self.migrate_db())
+        socket_dir = tempfile.mkdtemp(prefix="rainsim-api-")
+        worker_main = functools.partial(APIManager.run_worker, num_workers=num_workers, socket_dir=socket_dir)
+        server = PreforkServer(worker_main, num_workers, host, port, exclusive_slots=(0,))
+        try:
+            server.run()
+        finally:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+    # Worker process, with its own event loop and Motor client created after the fork
+    # Besides the shared socket it serves on its own Unix socket for the other workers
+    @staticmethod
+    def run_worker(slot, sock, ready_fd, num_workers, socket_dir):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        manager = APIManager()
+        loop.run_until_complete(manager.initialize_api(migrate=False, sensors_config=SENSORS_CONFIG if slot == 0 else "[]",
+                                                       worker=slot, num_workers=num_workers, socket_dir=socket_dir))
+
+        # Tell the master the worker is serving, the shared socket is already listening
+        async def notify_ready(app):
+            os.write(ready_fd, b"1")
+            os.close(ready_fd)
+        manager.app.on_startup.append(notify_ready)
+
+        log.info("## Worker {} with pid {} starting ##".format(slot, os.getpid()))
+        web.run_app(manager.app, sock=sock, path=manager.subapp['peers'].path(slot), loop=loop, print=None)
+
 
     ##############################################################################################################################
     ######################################################### API ROUTES #########################################################
@@ -91,33 +270,595 @@ class APIManager():
     # API healthcheck
     @routes.get('/healthz-api')
     async def api_health_check(request):
-        log.info("## API health-check running ##\n")
+        log.debug("## API health-check running ##")
         return web.Response(text="## API health-check successfull ##\n")
 
-    # DB healthcheck
+    # DB healthcheck, reads the state cached by the background probe and never queries the DB
     @routes.get('/healthz-db')
     async def db_health_check(request):
-        log.info("## DB health-check running ##")
+        state = request.app['db_probe'].state()
+        return web.json_response(state, status=200 if state["healthy"] else 503)
+
+    # Liveness, the event loop is serving requests
+    @routes.get('/livez')
+    async def liveness_check(request):
+        return web.Response(text="## API alive ##\n")
+
+    # Readiness, the API can serve requests that need the DB
+    @routes.get('/readyz')
+    async def readiness_check(request):
+        if request.app['db_probe'].is_ready():
+            return web.Response(text="## API ready ##\n")
+        return web.Response(text="!! API not ready, DB not available !!\n", status=503)
+
+    # Metrics in the Prometheus text format
+    # Metrics of all workers of a multi-process server, every series is labelled with its worker
+    @routes.get('/metrics')
+    async def metrics(request):
+        peers = request.app.get('peers')
+        peer_series = await peers.gather('/internal/metrics') if peers is not None else ()
+        return web.Response(text=request.app['metrics'].render(peer_series), content_type="text/plain", charset="utf-8",
+                            headers={"Cache-Control": "no-cache"})
+
+    # Check that an internal route is requested by another worker over its Unix socket
+    def check_internal(request):
+        if request.app.get('peers') is None or not WorkerPeers.is_internal(request):
+            raise web.HTTPNotFound()
+
+    # Metrics series of this worker for the scrape of another worker
+    @routes.get('/internal/metrics')
+    async def internal_metrics(request):
+        APIManager.check_internal(request)
+        return web.json_response(request.app['metrics'].series())
+
+    # Relay link of another worker, it subscribes to the topics of its own clients
+    @routes.get('/internal/ws')
+    async def internal_live_feed(request):
+        APIManager.check_internal(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        await request.app['broadcaster'].serve(ws, peer=True)
+        return ws
+
+    # Forward a sensor request to the worker owning the sensors, None if this process runs them
+    async def forward_sensor_request(request):
+        peers = request.app.get('peers')
+        if peers is None:
+            return None
+        return await peers.forward_to_owner(request)
+
+    # Get a configured depth camera or raise 404
+    def get_camera(request):
+        camera = request.app['sensors'].get(request.match_info['sensor_id'])
+        if not isinstance(camera, RealSenseSensor):
+            raise web.HTTPNotFound(text="!! Depth camera {} is not configured !!\n".format(request.match_info['sensor_id']))
+        return camera
+
+    # Number of frames to average from the frames query parameter, a capture averages at most the frame stack of the camera
+    def get_num_frames(request, camera):
+        try:
+            num_frames = int(request.query.get('frames', 10))
+        except ValueError:
+            raise web.HTTPBadRequest(text="!! Query parameter frames must be an integer !!\n")
+        if not 1 <= num_frames <= camera.stack_size:
+            raise web.HTTPBadRequest(text="!! Query parameter frames must be between 1 and {} !!\n".format(camera.stack_size))
+        return num_frames
+
+    # Depth camera baseline capture
+    @routes.post('/camera/{sensor_id}/baseline')
+    async def camera_baseline(request):
+        forwarded = await APIManager.forward_sensor_request(request)
+        if forwarded is not None:
+            return forwarded
+        camera = APIManager.get_camera(request)
+        num_frames = APIManager.get_num_frames(request, camera)
+
+        log.info("## Capturing baseline of depth camera {} ##".format(camera.sensor_id))
+        try:
+            baseline = await camera.capture_baseline(num_frames)
+        except asyncio.TimeoutError:
+            log.error("!! Baseline capture of depth camera {} timed out !!".format(camera.sensor_id))
+            raise web.HTTPGatewayTimeout(text="!! Baseline capture timed out, depth camera is not delivering frames !!\n")
+        except RuntimeError as e:
+            log.error("!! Baseline capture failed with error: {} !!".format(e))
+            raise web.HTTPConflict(text="!! Baseline capture failed: {} !!\n".format(e))
+
+        return web.json_response({"sensor": camera.sensor_id,
+                                  "frames": num_frames,
+                                  "valid_pixels": int((baseline > 0).sum())})
+
+    # Depth camera final capture and volume change calculation
+    @routes.post('/camera/{sensor_id}/volume')
+    async def camera_volume(request):
+        forwarded = await APIManager.forward_sensor_request(request)
+        if forwarded is not None:
+            return forwarded
+        camera = APIManager.get_camera(request)
+        num_frames = APIManager.get_num_frames(request, camera)
+        try:
+            roi = tuple(int(value) for value in request.query['roi'].split(',')) if 'roi' in request.query else None
+        except ValueError:
+            raise web.HTTPBadRequest(text="!! Query parameter roi (x,y,w,h) must be integers !!\n")
+        if roi is not None and len(roi) != 4:
+            raise web.HTTPBadRequest(text="!! Query parameter roi must be x,y,w,h !!\n")
 
+        log.info("## Calculating volume change of depth camera {} ##".format(camera.sensor_id))
         try:
-            # Get DB client
-            db = request.app['db_client']
-        except Exception as e:
-            log.error("!! DB health-check failed with error: {}".format(e))
-            return web.Response(text="!! DB health-check failed !!\n")
-        else:
+            volume_change = await camera.capture_volume_change(num_frames, roi)
+        except asyncio.TimeoutError:
+            log.error("!! Final capture of depth camera {} timed out !!".format(camera.sensor_id))
+            raise web.HTTPGatewayTimeout(text="!! Final capture timed out, depth camera is not delivering frames !!\n")
+        except RuntimeError as e:
+            log.error("!! Volume calculation failed with error: {} !!".format(e))
+            raise web.HTTPConflict(text="!! Volume calculation failed: {} !!\n".format(e))
+
+        return web.json_response({"sensor": camera.sensor_id,
+                                  "frames": num_frames,
+                                  "roi": roi,
+                                  "volume_change": volume_change})
+
+    # Create an experiment, the body is {"name": ..., "description": ...}
+    @routes.post('/experiments')
+    async def create_experiment(request):
+        try:
+            body = await request.json()
+            name, description = str(body['name']), str(body.get('description', ''))
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPBadRequest(text="!! Body must be {\"name\": ..., \"description\": ...} !!\n")
+
+        try:
+            await request.app['dal'].create_experiment(name, description)
+        except DuplicateKeyError:
+            raise web.HTTPConflict(text="!! Experiment {} already exists !!\n".format(name))
+        except PyMongoError as e:
+            log.error("!! Creating experiment {} failed with error: {} !!".format(name, e))
+            raise web.HTTPServiceUnavailable(text="!! Creating experiment failed, DB not available !!\n")
+
+        log.info("## Experiment {} created ##".format(name))
+        return web.json_response({"experiment": name}, status=201)
+
+    # Stop an experiment, its data is immutable from now on
+    @routes.post('/experiments/{experiment}/stop')
+    async def stop_experiment(request):
+        experiment = request.match_info['experiment']
+        try:
+            stopped = await request.app['dal'].stop_experiment(experiment)
+        except PyMongoError as e:
+            log.error("!! Stopping experiment {} failed with error: {} !!".format(experiment, e))
+            raise web.HTTPServiceUnavailable(text="!! Stopping experiment failed, DB not available !!\n")
+        if not stopped:
+            raise web.HTTPConflict(text="!! Experiment {} does not exist or is already stopped !!\n".format(experiment))
+
+        log.info("## Experiment {} stopped ##".format(experiment))
+        request.app['result_cache'].set_completed(experiment)
+        return web.json_response({"experiment": experiment})
+
+    # Check if an experiment is completed, completed experiments are remembered and never looked up again
+    async def is_experiment_completed(app, experiment):
+        cache = app['result_cache']
+        if cache.is_completed(experiment):
+            return True
+        document = await app['dal'].get_experiment(experiment)
+        if document is not None and document.get('stop') is not None:
+            cache.set_completed(experiment)
+            return True
+        return False
+
+    # Check that data can be stored in an experiment, raises 404 for experiments that were never created and 409 for
+    # stopped ones, experiments are only created by the experiments route so misspelled names never get data
+    async def check_experiment_open(app, experiment, description):
+        cache = app['result_cache']
+        if cache.is_completed(experiment):
+            raise web.HTTPConflict(text="!! Experiment {} is stopped !!\n".format(experiment))
+        try:
+            document = await app['dal'].get_experiment(experiment)
+        except PyMongoError as e:
+            log.error("!! {} for experiment {} failed with error: {} !!".format(description, experiment, e))
+            raise web.HTTPServiceUnavailable(text="!! {} failed, DB not available !!\n".format(description))
+        if document is None:
+            raise web.HTTPNotFound(text="!! Experiment {} does not exist !!\n".format(experiment))
+        if document.get('stop') is not None:
+            cache.set_completed(experiment)
+            raise web.HTTPConflict(text="!! Experiment {} is stopped !!\n".format(experiment))
+
+    # JSON response of a query, results of completed experiments are cached and served with a strong ETag
+    async def cached_json_response(request, experiment, query, description):
+        cache = request.app['result_cache']
+        try:
+            if not await APIManager.is_experiment_completed(request.app, experiment):
+                return web.json_response(await query())
+
+            key = cache.key(experiment, request.path, request.query)
+            result = cache.get(key)
+            if result is None:
+                result = cache.put(key, json.dumps(await query()).encode(), "application/json")
+        except PyMongoError as e:
+            log.error("!! {} of experiment {} failed with error: {} !!".format(description, experiment, e))
+            raise web.HTTPServiceUnavailable(text="!! {} failed, DB not available !!\n".format(description))
+
+        headers = {"ETag": '"{}"'.format(result.etag), "Cache-Control": "public, max-age=86400"}
+        if any(etag.value in (result.etag, "*") for etag in request.if_none_match or ()):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=result.body, content_type=result.content_type, headers=headers)
+
+    # Callback of the ingest batches, every batch is also broadcast once to the live subscribers of the experiment and sensor
+    def ingest_broadcaster(app, experiment, sensor_id):
+        broadcaster = app['broadcaster']
+        topic = "{}/{}".format(experiment, sensor_id)
+        def broadcast(documents):
+            if broadcaster.has_subscribers(topic):
+                broadcaster.publish(topic, [[document["timestamp"].timestamp(), document["value"]] for document in documents])
+        return broadcast
+
+    # Batched sample ingest, the body is a JSON array or NDJSON of {"timestamp": ..., "value": ...} or [timestamp, value]
+    @routes.post('/experiments/{experiment}/sensors/{sensor_id}/samples')
+    async def ingest_samples(request):
+        experiment = request.match_info['experiment']
+        sensor_id = request.match_info['sensor_id']
+        body_format = "ndjson" if request.content_type in ("application/x-ndjson", "application/jsonl") else "json"
+        decoder = SampleDecoder(experiment, sensor_id, body_format)
+
+        # Data of completed experiments is immutable, cached results stay valid
+        await APIManager.check_experiment_open(request.app, experiment, "Ingest")
+
+        # The body is decoded and inserted while it is still being received
+        broadcast = APIManager.ingest_broadcaster(request.app, experiment, sensor_id)
+        try:
+            batches = await request.app['dal'].ingest(decoder, request.content.iter_chunked(65536), INGEST_BATCH_SIZE, on_batch=broadcast)
+        except SampleDecodeError as e:
+            # The samples before the invalid one may already be stored, the response tells the client which were
+            log.error("!! Ingest for {}/{} failed with error: {} !!".format(experiment, sensor_id, e))
+            batches = getattr(e, "batches", [])
+            return web.json_response({"error": str(e),
+                                      "experiment": experiment,
+                                      "sensor": sensor_id,
+                                      "received": sum(batch["received"] for batch in batches),
+                                      "inserted": sum(batch["inserted"] for batch in batches),
+                                      "batches": batches}, status=400)
+        except PyMongoError as e:
+            log.error("!! Ingest for {}/{} failed with error: {} !!".format(experiment, sensor_id, e))
+            raise web.HTTPServiceUnavailable(text="!! Ingest failed, DB not available !!\n")
+
+        inserted = sum(batch["inserted"] for batch in batches)
+        metrics = request.app['metrics']
+        metrics.ingest_received.inc(amount=decoder.num_samples)
+        metrics.ingest_inserted.inc(amount=inserted)
+        metrics.ingest_batches.inc(amount=len(batches))
+        log.debug("## Ingested {} samples for {}/{} ##".format(inserted, experiment, sensor_id))
+        return web.json_response({"experiment": experiment,
+                                  "sensor": sensor_id,
+                                  "received": decoder.num_samples,
+                                  "inserted": inserted,
+                                  "batches": batches})
+
+    # Parse the optional start and stop query parameters, seconds since the epoch or ISO 8601
+    def get_time_range(request, names=('start', 'stop')):
+        time_range = []
+        for name in names:
+            value = request.query.get(name)
+            try:
+                if value is None:
+                    time_range.append(None)
+                elif value.replace('.', '', 1).isdigit():
+                    time_range.append(datetime.fromtimestamp(float(value), timezone.utc))
+                else:
+                    time_range.append(parse_iso_timestamp(value))
+            except ValueError:
+                raise web.HTTPBadRequest(text="!! Query parameter {} must be seconds since the epoch or an ISO 8601 date !!\n".format(name))
+        return time_range
+
+    # Samples of a sensor in a time range, served by the time-series collection (see MongoDAL.find_samples)
+    @routes.get('/experiments/{experiment}/sensors/{sensor_id}/samples')
+    async def get_samples(request):
+        experiment = request.match_info['experiment']
+        sensor_id = request.match_info['sensor_id']
+        start, stop = APIManager.get_time_range(request)
+        try:
+            limit = int(request.query.get('limit', 1000))
+        except ValueError:
+            raise web.HTTPBadRequest(text="!! Query parameter limit must be an integer !!\n")
+        if not 0 < limit <= 10000:
+            raise web.HTTPBadRequest(text="!! Query parameter limit must be between 1 and 10000, use the export for more !!\n")
+
+        async def query():
+            samples = [[sample["timestamp"].replace(tzinfo=timezone.utc).timestamp(), sample["value"]]
+                       async for sample in request.app['dal'].find_samples(experiment, sensor_id, start, stop, limit)]
+            return {"experiment": experiment, "sensor": sensor_id, "samples": samples}
+
+        return await APIManager.cached_json_response(request, experiment, query, "Reading samples")
+
+    # Time-bucketed aggregates of a sensor, the number of buckets follows the plot width and not the experiment length
+    @routes.get('/experiments/{experiment}/sensors/{sensor_id}/aggregate')
+    async def aggregate_samples(request):
+        experiment = request.match_info['experiment']
+        sensor_id = request.match_info['sensor_id']
+        start, stop = APIManager.get_time_range(request)
+        try:
+            points = int(request.query.get('points', 500))
+            bucket = float(request.query['bucket']) if 'bucket' in request.query else None
+        except ValueError:
+            raise web.HTTPBadRequest(text="!! Query parameters points and bucket must be numbers !!\n")
+        if not 0 < points <= 10000 or (bucket is not None and bucket <= 0):
+            raise web.HTTPBadRequest(text="!! Query parameter points must be between 1 and 10000 and bucket positive !!\n")
+
+        async def query():
+            dal = request.app['dal']
+            # A missing start or stop is the first or last sample of the sensor
+            range_start, range_stop = start, stop
+            if range_start is None or range_stop is None:
+                first, last = await dal.find_time_range(experiment, sensor_id)
+                if first is None:
+                    return {"experiment": experiment, "sensor": sensor_id, "bucket": bucket, "buckets": []}
+                range_start = range_start or first
+                range_stop = range_stop or last + timedelta(milliseconds=1)
+
+            # Bucket width in whole milliseconds, either requested or the range split into points buckets
+            bucket_ms = max(int(math.ceil((bucket or (range_stop - range_start).total_seconds() / points) * 1e3)), 1)
+            buckets = await dal.aggregate_samples(experiment, sensor_id, range_start, range_stop, bucket_ms)
+            return {"experiment": experiment, "sensor": sensor_id, "bucket": bucket_ms / 1e3, "buckets": buckets}
+
+        return await APIManager.cached_json_response(request, experiment, query, "Aggregating samples")
+
+    # Parse the pixel format query parameters of a depth frame upload, the scale is meters per depth unit
+    def get_frame_format(request):
+        try:
+            width, height = int(request.query['width']), int(request.query['height'])
+            scale = float(request.query.get('scale', 0.001))
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text="!! Query parameters width and height must be integers and scale a number !!\n")
+        dtype = request.query.get('dtype', 'uint16')
+        if not (0 < width <= 8192 and 0 < height <= 8192) or not scale > 0:
+            raise web.HTTPBadRequest(text="!! Query parameters width and height must be between 1 and 8192 and scale positive !!\n")
+        if dtype not in FRAME_DTYPES:
+            raise web.HTTPBadRequest(text="!! Query parameter dtype must be one of {} !!\n".format(", ".join(FRAME_DTYPES)))
+        return width, height, dtype, scale
+
+    # Depth frame upload, the body is one raw little-endian frame of height rows and width columns as application/octet-stream
+    @routes.post('/experiments/{experiment}/sensors/{sensor_id}/frames')
+    async def upload_frame(request):
+        experiment = request.match_info['experiment']
+        sensor_id = request.match_info['sensor_id']
+        if request.content_type != 'application/octet-stream':
+            raise web.HTTPUnsupportedMediaType(text="!! Depth frames must be uploaded as application/octet-stream !!\n")
+        width, height, dtype, scale = APIManager.get_frame_format(request)
+        timestamp, = APIManager.get_time_range(request, ('timestamp',))
+        timestamp = timestamp or datetime.now(timezone.utc)
+
+        # A body of the wrong size is rejected before it is received
+        decoder = FrameDecoder(width, height, dtype)
+        if request.content_length is not None and request.content_length != decoder.frame_size:
+            raise web.HTTPBadRequest(text="!! Request body has {} bytes, one {}x{} {} frame has {} bytes !!\n".format(
+                request.content_length, width, height, dtype, decoder.frame_size))
+
+        # Data of completed experiments is immutable, cached results stay valid
+        await APIManager.check_experiment_open(request.app, experiment, "Frame upload")
+
+        # The frame is compressed while it is still being received
+        try:
+            async for chunk in request.content.iter_chunked(FRAME_CHUNK_SIZE):
+                decoder.feed(chunk)
+            data = decoder.finish()
+        except FrameDecodeError as e:
+            log.error("!! Frame upload for {}/{} failed with error: {} !!".format(experiment, sensor_id, e))
+            raise web.HTTPBadRequest(text="!! {} !!\n".format(e))
+
+        try:
+            frame_id = await request.app['dal'].insert_frame(experiment, sensor_id, timestamp, data, decoder.shape, decoder.dtype,
+                                                             scale, FRAME_GRIDFS_THRESHOLD_KB * 1024)
+        except PyMongoError as e:
+            log.error("!! Frame upload for {}/{} failed with error: {} !!".format(experiment, sensor_id, e))
+            raise web.HTTPServiceUnavailable(text="!! Frame upload failed, DB not available !!\n")
+
+        metrics = request.app['metrics']
+        metrics.frames_received.inc()
+        metrics.frame_bytes_received.inc(amount=decoder.frame_size)
+        metrics.frame_bytes_stored.inc(amount=len(data))
+        log.debug("## Stored {} byte frame for {}/{} compressed to {} bytes ##".format(decoder.frame_size, experiment, sensor_id, len(data)))
+        return web.json_response({"experiment": experiment,
+                                  "sensor": sensor_id,
+                                  "frame": str(frame_id),
+                                  "timestamp": timestamp.timestamp(),
+                                  "shape": list(decoder.shape),
+                                  "dtype": decoder.dtype,
+                                  "scale": scale,
+                                  "size": decoder.frame_size,
+                                  "compressed_size": len(data)}, status=201)
+
+    # Metadata of the depth frames of a sensor in a time range, the frames are read one by one by id
+    @routes.get('/experiments/{experiment}/sensors/{sensor_id}/frames')
+    async def get_frames(request):
+        experiment = request.match_info['experiment']
+        sensor_id = request.match_info['sensor_id']
+        start, stop = APIManager.get_time_range(request)
+        try:
+            limit = int(request.query.get('limit', 1000))
+        except ValueError:
+            raise web.HTTPBadRequest(text="!! Query parameter limit must be an integer !!\n")
+        if not 0 < limit <= 10000:
+            raise web.HTTPBadRequest(text="!! Query parameter limit must be between 1 and 10000 !!\n")
+
+        async def query():
+            frames = [{"frame": str(frame["_id"]),
+                       "timestamp": frame["timestamp"].replace(tzinfo=timezone.utc).timestamp(),
+                       "shape": frame["shape"],
+                       "dtype": frame["dtype"],
+                       "scale": frame["scale"],
+                       "compressed_size": frame["size"]}
+                      async for frame in request.app['dal'].find_frames(experiment, sensor_id, start, stop, limit)]
+            return {"experiment": experiment, "sensor": sensor_id, "frames": frames}
+
+        return await APIManager.cached_json_response(request, experiment, query, "Reading frames")
+
+    # One depth frame as raw little-endian pixels, the shape, dtype and scale are sent in headers
+    # Frames never change, the frame id is their ETag
+    @routes.get('/experiments/{experiment}/sensors/{sensor_id}/frames/{frame_id}')
+    async def get_frame(request):
+        experiment = request.match_info['experiment']
+        sensor_id = request.match_info['sensor_id']
+        try:
+            frame_id = ObjectId(request.match_info['frame_id'])
+        except InvalidId:
+            raise web.HTTPNotFound(text="!! Frame {} not found !!\n".format(request.match_info['frame_id']))
+
+        # The frame must exist before a cached copy is confirmed, it is only decompressed when it is sent
+        dal = request.app['dal']
+        try:
+            frame = await dal.find_frame(experiment, sensor_id, frame_id)
+            if frame is None:
+                raise web.HTTPNotFound(text="!! Frame {} not found !!\n".format(frame_id))
+
+            headers = {"ETag": '"{}"'.format(frame_id), "Cache-Control": "public, max-age=86400"}
+            if any(etag.value in (str(frame_id), "*") for etag in request.if_none_match or ()):
+                return web.Response(status=304, headers=headers)
+
+            buffer = await dal.load_frame(frame)
+        except PyMongoError as e:
+            log.error("!! Reading frame {} of {}/{} failed with error: {} !!".format(frame_id, experiment, sensor_id, e))
+            raise web.HTTPServiceUnavailable(text="!! Reading frame failed, DB not available !!\n")
+        except FrameDecodeError as e:
+            log.error("!! Reading frame {} of {}/{} failed with error: {} !!".format(frame_id, experiment, sensor_id, e))
+            raise web.HTTPInternalServerError(text="!! Reading frame failed, stored frame is invalid !!\n")
+
+        headers.update({"X-Frame-Shape": ",".join(str(size) for size in frame["shape"]),
+                        "X-Frame-Dtype": frame["dtype"],
+                        "X-Frame-Scale": str(frame["scale"]),
+                        "X-Frame-Timestamp": str(frame["timestamp"].replace(tzinfo=timezone.utc).timestamp())})
+        return web.Response(body=buffer, content_type="application/octet-stream", headers=headers)
+
+    # Streaming export of an experiment as CSV or NDJSON, optionally of one sensor and a time range
+    @routes.get('/experiments/{experiment}/export')
+    async def export_experiment(request):
+        experiment = request.match_info['experiment']
+        sensor_id = request.query.get('sensor')
+        export_format = request.query.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise web.HTTPBadRequest(text="!! Query parameter format must be one of: {} !!\n".format(", ".join(EXPORT_FORMATS)))
+        start, stop = APIManager.get_time_range(request)
+
+        log.info("## Exporting experiment {} as {} ##".format(experiment, export_format))
+        content_type, extension = EXPORT_FORMATS[export_format]
+        response = web.StreamResponse(headers={
+            "Content-Type": "{}; charset=utf-8".format(content_type),
+            "Content-Disposition": 'attachment; filename="{}.{}"'.format(experiment, extension),
+            # Disable response buffering in the nginx reverse proxy
+            "X-Accel-Buffering": "no",
+        })
+        response.enable_chunked_encoding()
+
+        # Documents are encoded per cursor batch and written in chunks, memory does not depend on the export size
+        encoder = SampleEncoder(export_format)
+        cursor = request.app['dal'].export_samples(experiment, sensor_id, start, stop, EXPORT_BATCH_SIZE)
+        chunk = encoder.header()
+        num_samples = 0
+        try:
+            await response.prepare(request)
+            documents = []
+            async for document in cursor:
+                documents.append(document)
+                if len(documents) < EXPORT_BATCH_SIZE:
+                    continue
+                chunk = chunk + encoder.encode(documents)
+                num_samples = num_samples + len(documents)
+                documents = []
+                if len(chunk) >= EXPORT_CHUNK_SIZE:
+                    await response.write(chunk.encode())
+                    chunk = ""
+            chunk = chunk + encoder.encode(documents)
+            num_samples = num_samples + len(documents)
+            await response.write(chunk.encode())
+            await response.write_eof()
+        except PyMongoError as e:
+            # The status is already sent, the client sees a truncated chunked response
+            log.error("!! Export of experiment {} failed with error: {} !!".format(experiment, e))
+            raise
+        except ConnectionResetError:
+            log.info("## Export of experiment {} cancelled by the client ##".format(experiment))
+            raise
+        finally:
+            await cursor.close()
+
+        log.info("## Exported {} samples of experiment {} ##".format(num_samples, experiment))
+        return response
+
+    # Live sample feed, clients subscribe to "<experiment>/<sensor_id>", "<experiment>/*" or "live/<sensor_id>" topics
+    @routes.get('/ws')
+    async def live_feed(request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        log.debug("## WebSocket client connected ##")
+        await request.app['broadcaster'].serve(ws)
+        log.debug("## WebSocket client disconnected ##")
+        return ws
+
+    # Downsampled live view of a sensor, e.g. the last 6 hours at 500 points
+    @routes.get('/sensors/{sensor_id}/live')
+    async def sensor_live_view(request):
+        forwarded = await APIManager.forward_sensor_request(request)
+        if forwarded is not None:
+            return forwarded
+        sensor = request.app['sensors'].get(request.match_info['sensor_id'])
+        if sensor is None:
+            raise web.HTTPNotFound(text="!! Sensor {} is not configured !!\n".format(request.match_info['sensor_id']))
+        try:
+            seconds = float(request.query.get('seconds', 3600))
+            points = int(request.query.get('points', 500))
+        except ValueError:
+            raise web.HTTPBadRequest(text="!! Query parameters seconds and points must be numbers !!\n")
+        if not (math.isfinite(seconds) and seconds > 0):
+            raise web.HTTPBadRequest(text="!! Query parameter seconds must be a positive number !!\n")
+        if not 0 < points <= 10000:
+            raise web.HTTPBadRequest(text="!! Query parameter points must be between 1 and 10000 !!\n")
+
+        # The window ends at the latest sample so simulated sensors running ahead of real time work too
+        stop = sensor.buffer.last_timestamp
+        buckets = [] if stop is None else sensor.buffer.downsample(stop - seconds, stop, points)
+        return web.json_response({"sensor": sensor.sensor_id, "seconds": seconds, "points": points, "buckets": buckets})
+
+    # Live as-of join of scalar sensors over a WebSocket, every sample of the primary sensor is sent with the latest values
+    # of the other sensors, e.g. ?primary=rain&sensors=flow,pressure&tolerance=1
+    @routes.get('/sensors/aligned')
+    async def aligned_feed(request):
+        peers = request.app.get('peers')
+        if peers is not None and not peers.is_owner:
+            return await peers.forward_ws(request, peers.owner_slot)
+        primary = request.query.get('primary')
+        if primary is None:
+            raise web.HTTPBadRequest(text="!! Query parameter primary is required !!\n")
+        sensor_ids = [primary] + [sensor_id for sensor_id in request.query.get('sensors', '').split(',') if sensor_id and sensor_id != primary]
+        try:
+            tolerance = float(request.query['tolerance']) if 'tolerance' in request.query else None
+            lateness = float(request.query.get('lateness', 0.5))
+        except ValueError:
+            raise web.HTTPBadRequest(text="!! Query parameters tolerance and lateness must be numbers !!\n")
+        sensors = []
+        for sensor_id in sensor_ids:
+            sensor = request.app['sensors'].get(sensor_id)
+            if sensor is None:
+                raise web.HTTPNotFound(text="!! Sensor {} is not configured !!\n".format(sensor_id))
+            if isinstance(sensor, RealSenseSensor):
+                raise web.HTTPBadRequest(text="!! Only scalar sensors can be aligned, {} is a depth camera !!\n".format(sensor_id))
+            sensors.append(sensor)
+
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        # Records are sent while the client is connected, the client only closes the feed
+        async def send_records():
+            records = asof_join(StreamMerger(sensors, lateness), primary, tolerance)
             try:
-                # Check if DB is alive
-                info = await db.server_info()
-            except Exception as e:
-                log.error("!! DB health-check failed with error: {}".format(e))
-                return web.Response(text="!! DB health-check failed !!\n")
-            else:
-                # If DB is alive return success
-                log.info("## DB health-check successfull ##\n")
-                log.info("## DB info: {} ##\n".format(info))
+                async for record in records:
+                    await ws.send_str(json.dumps({"timestamp": record.timestamp, "values": record.values}))
             finally:
-                return web.Response(text="## DB health-check successfull ##\n")
+                await records.aclose()
+                await ws.close()
+        sender = asyncio.create_task(send_records())
+        try:
+            async for message in ws:
+                pass
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+        return ws
             
 
 
@@ -133,7 +874,8 @@ if __name__ == '__main__':
         # Development build
         logging.basicConfig(level=logging.DEBUG)
         
-        # Set DB connection parameters
+        # Set DB connection parameters and serve from a single process
+        API_WORKERS = 1
         DB_MIN_POOL_SIZE = 1
         DB_MAX_POOL_SIZE = 1
         DB_SERVER_SELECTION_TIMEOUT_MS = 5000
@@ -143,11 +885,19 @@ if __name__ == '__main__':
         log = logging.getLogger()
         log.info("## Starting API server in development mode ##")
         log.info("## URL_PREFIX: {} ##".format(URL_PREFIX))
+        log.info("## API_WORKERS: {} ##".format(API_WORKERS))
         log.info("## DB_CONNECTION_STRING: {} ##".format(DB_CONNECTION_STRING))
         log.info("## DB_MIN_POOL_SIZE: {} ##".format(DB_MIN_POOL_SIZE))
         log.info("## DB_MAX_POOL_SIZE: {} ##".format(DB_MAX_POOL_SIZE))
         log.info("## DB_SERVER_SELECTION_TIMEOUT_MS: {} ##".format(DB_SERVER_SELECTION_TIMEOUT_MS))
         log.info("## DB_MAX_IDLE_TIME_MS: {} ##".format(DB_MAX_IDLE_TIME_MS))
+        log.info("## DB_HEALTH_INTERVAL_S: {} ##".format(DB_HEALTH_INTERVAL_S))
+        log.info("## INGEST_BATCH_SIZE: {} ##".format(INGEST_BATCH_SIZE))
+        log.info("## EXPORT_BATCH_SIZE: {} ##".format(EXPORT_BATCH_SIZE))
+        log.info("## FRAME_GRIDFS_THRESHOLD_KB: {} ##".format(FRAME_GRIDFS_THRESHOLD_KB))
+        log.info("## CACHE_SIZE_MB: {} ##".format(CACHE_SIZE_MB))
+        log.info("## BROADCAST_QUEUE_SIZE: {} ##".format(BROADCAST_QUEUE_SIZE))
+        log.info("## SENSORS_CONFIG: {} ##".format(SENSORS_CONFIG))
 
     elif API_CONFIG == "prod":
         # Production build
@@ -155,11 +905,19 @@ if __name__ == '__main__':
         log = logging.getLogger()
         log.info("Starting API server in production mode")
         log.info("URL_PREFIX: {}".format(URL_PREFIX))
+        log.info("API_WORKERS: {}".format(API_WORKERS))
         log.info("DB_CONNECTION_STRING: {}".format(DB_CONNECTION_STRING))
         log.info("DB_MIN_POOL_SIZE: {}".format(DB_MIN_POOL_SIZE))
         log.info("DB_MAX_POOL_SIZE: {}".format(DB_MAX_POOL_SIZE))
         log.info("DB_SERVER_SELECTION_TIMEOUT_MS: {}".format(DB_SERVER_SELECTION_TIMEOUT_MS))
         log.info("DB_MAX_IDLE_TIME_MS: {}".format(DB_MAX_IDLE_TIME_MS))
+        log.info("DB_HEALTH_INTERVAL_S: {}".format(DB_HEALTH_INTERVAL_S))
+        log.info("INGEST_BATCH_SIZE: {}".format(INGEST_BATCH_SIZE))
+        log.info("EXPORT_BATCH_SIZE: {}".format(EXPORT_BATCH_SIZE))
+        log.info("FRAME_GRIDFS_THRESHOLD_KB: {}".format(FRAME_GRIDFS_THRESHOLD_KB))
+        log.info("CACHE_SIZE_MB: {}".format(CACHE_SIZE_MB))
+        log.info("BROADCAST_QUEUE_SIZE: {}".format(BROADCAST_QUEUE_SIZE))
+        log.info("SENSORS_CONFIG: {}".format(SENSORS_CONFIG))
 
     else:
         # If APP_CONFIG env variable is not set abort start
@@ -168,6 +926,12 @@ if __name__ == '__main__':
         log.info("Environment variable API_CONFIG is not set (Current value is: {}), please set it in  the environment file".format(API_CONFIG))
         sys.exit(1)
 
+    # Multi-process serving, every worker has its own event loop and Motor client
+    if API_WORKERS > 1:
+        manager = APIManager()
+        manager.run_api_workers(host='0.0.0.0', port=5000, num_workers=API_WORKERS)
+        sys.exit(0)
+
     # Get asyncio loop
     loop = asyncio.get_event_loop()
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import hashlib
+from collections import OrderedDict, namedtuple
+
+# Cached response body with its content type and strong ETag
+CachedResult = namedtuple("CachedResult", ["body", "content_type", "etag"])
+
+
+class ResultCache():
+    """
+        Size-bounded LRU cache of rendered query results of completed experiments, their data never changes
+    """
+
+    # Initialize the cache, max_bytes bounds the total size of the cached bodies
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_completed=4096):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.results = OrderedDict()
+        # Names of experiments known to be completed, a completed experiment is never reopened
+        self.max_completed = max_completed
+        self.completed = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    # Cache key of a request, the query parameters are sorted so their order does not matter
+    @staticmethod
+    def key(experiment, path, query):
+        return (experiment, path, tuple(sorted(query.items())))
+
+    # Get a cached result and mark it as recently used
+    def get(self, key):
+        result = self.results.get(key)
+        if result is None:
+            self.misses = self.misses + 1
+            return None
+        self.results.move_to_end(key)
+        self.hits = self.hits + 1
+        return result
+
+    # Cache a rendered body, the least recently used results are evicted until it fits
+    def put(self, key, body, content_type):
+        result = CachedResult(body, content_type, hashlib.sha256(body).hexdigest()[:32])
+        if len(body) > self.max_bytes:
+            return result
+        if key in self.results:
+            self.num_bytes = self.num_bytes - len(self.results.pop(key).body)
+        while self.results and self.num_bytes + len(body) > self.max_bytes:
+            _, evicted = self.results.popitem(last=False)
+            self.num_bytes = self.num_bytes - len(evicted.body)
+        self.results[key] = result
+        self.num_bytes = self.num_bytes + len(body)
+        return result
+
+    # Remember completed experiments so their status is looked up only once
+    def is_completed(self, experiment):
+        if experiment in self.completed:
+            self.completed.move_to_end(experiment)
+            return True
+        return False
+
+    def set_completed(self, experiment):
+        self.completed[experiment] = True
+        if len(self.completed) > self.max_completed:
+            self.completed.popitem(last=False)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import json, codecs, csv, io, zlib, re
+from datetime import datetime, timezone
+import numpy as np
+
+
+# Content types and file extensions of the export formats
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+# Parse an ISO 8601 timestamp, "Z" (e.g. from JavaScript toISOString()) is accepted before Python 3.11 too
+# and timestamps without a timezone are in UTC like the stored timestamps
+def parse_iso_timestamp(text):
+    if text.endswith(("Z", "z")):
+        text = text[:-1] + "+00:00"
+    timestamp = datetime.fromisoformat(text)
+    return timestamp if timestamp.tzinfo is not None else timestamp.replace(tzinfo=timezone.utc)
+
+
+# Rest of a JSON array after a decode error that is only the start of a number or literal split by a chunk boundary
+TRUNCATED_VALUE = re.compile(r"[-+.0-9eE]*|t(r(ue?)?)?|f(a(l(se?)?)?)?|n(u(ll?)?)?|N(aN?)?|-?I(n(f(i(n(i(ty?)?)?)?)?)?)?")
+
+# Pixel types of uploaded depth frames, raw frames of the RealSense cameras are uint16
+FRAME_DTYPES = ("uint16", "uint8", "float32")
+
+
+class SampleEncoder():
+    """
+        Encoder of exported sensor data documents to CSV or NDJSON text, one call per cursor batch
+    """
+
+    # Initialize the encoder, the format is either "csv" or "ndjson"
+    def __init__(self, format="csv"):
+        self.format = format
+        self.text = io.StringIO()
+        self.writer = csv.writer(self.text, lineterminator="\n")
+
+    # CSV header line, NDJSON has none
+    def header(self):
+        return "timestamp,sensor,value\n" if self.format == "csv" else ""
+
+    # Encode a list of documents, timestamps are ISO 8601 in UTC and array values are JSON in CSV
+    def encode(self, documents):
+        if self.format == "ndjson":
+            return "".join(json.dumps({"timestamp": document["timestamp"].replace(tzinfo=timezone.utc).isoformat(),
+                                       "sensor": document["meta"]["sensor"],
+                                       "value": document["value"]}) + "\n" for document in documents)
+
+        self.text.seek(0)
+        self.text.truncate()
+        self.writer.writerows((document["timestamp"].replace(tzinfo=timezone.utc).isoformat(),
+                               document["meta"]["sensor"],
+                               document["value"] if isinstance(document["value"], (int, float, str)) else json.dumps(document["value"]))
+                              for document in documents)
+        return self.text.getvalue()
+
+
+class SampleDecodeError(ValueError):
+    """
+        Invalid sample in an ingest request body
+    """
+
+
+class SampleDecoder():
+    """
+        Incremental decoder of ingest request bodies, a JSON array or NDJSON of samples fed in chunks of any size
+    """
+
+    # Initialize the decoder, the format is either "json" or "ndjson"
+    def __init__(self, experiment, sensor, format="json"):
+        self.experiment = experiment
+        self.sensor = sensor
+        self.format = format
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.array_started = False
+        self.array_ended = False
+        self.num_samples = 0
+
+    # Convert one decoded sample, {"timestamp": ..., "value": ...} or [timestamp, value], to a sensor data document
+    def to_document(self, item):
+        try:
+            if isinstance(item, dict):
+                timestamp, value = item["timestamp"], item["value"]
+            else:
+                timestamp, value = item
+            # Timestamps are seconds since the epoch or ISO 8601 strings
+            if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+                timestamp = datetime.fromtimestamp(timestamp, timezone.utc)
+            else:
+                timestamp = parse_iso_timestamp(timestamp)
+        except (KeyError, TypeError, ValueError, OverflowError, AttributeError) as e:
+            raise SampleDecodeError("Invalid sample {}: {}".format(self.num_samples, e))
+
+        self.num_samples = self.num_samples + 1
+        return {"timestamp": timestamp, "meta": {"experiment": self.experiment, "sensor": self.sensor}, "value": value}
+
+    # Decode the complete samples of the next chunk, final is set with the last chunk
+    def feed(self, chunk, final=False):
+        self.text = self.text + self.utf8.decode(chunk, final)
+        if self.format == "ndjson":
+            documents = self.feed_lines(final)
+        else:
+            documents = self.feed_array(final)
+        if final and (self.text.strip() or (self.format == "json" and not self.array_ended)):
+            raise SampleDecodeError("Incomplete request body")
+        return documents
+
+    # Every complete line is one sample
+    def feed_lines(self, final):
+        lines = self.text.split("\n")
+        self.text = "" if final else lines.pop()
+        documents = []
+        for line in lines:
+            if line.strip():
+                try:
+                    documents.append(self.to_document(json.loads(line)))
+                except json.JSONDecodeError as e:
+                    raise SampleDecodeError("Invalid JSON line after sample {}: {}".format(self.num_samples, e))
+        return documents
+
+    # Check if a decode error is caused by the end of the buffer, e.g. in a string, number or literal
+    @staticmethod
+    def is_truncated(text, error):
+        return error.pos >= len(text) or error.msg.startswith("Unterminated string") or TRUNCATED_VALUE.fullmatch(text, error.pos) is not None
+
+    # Samples are decoded one by one from the array, an incomplete sample waits for the next chunk
+    def feed_array(self, final):
+        documents = []
+        position = 0
+        text = self.text
+        while True:
+            # Skip whitespace and the array punctuation between samples
+            while position < len(text) and text[position] in " \t\r\n,":
+                position = position + 1
+            if position == len(text) or self.array_ended:
+                break
+            if not self.array_started:
+                if text[position] != "[":
+                    raise SampleDecodeError("Request body must be a JSON array")
+                self.array_started = True
+                position = position + 1
+                continue
+            if text[position] == "]":
+                self.array_ended = True
+                position = position + 1
+                continue
+
+            try:
+                item, position = self.decoder.raw_decode(text, position)
+            except json.JSONDecodeError as e:
+                # Wait for the next chunk only when the sample is cut off at the end of the buffer, invalid JSON in
+                # the middle of the body fails right away instead of buffering the rest of the body
+                if final or not self.is_truncated(text, e):
+                    raise SampleDecodeError("Invalid JSON after sample {}: {}".format(self.num_samples, e))
+                break
+            documents.append(self.to_document(item))
+
+        self.text = text[position:]
+        return documents
+
+
+class FrameDecodeError(ValueError):
+    """
+        Invalid depth frame upload body
+    """
+
+
+class FrameDecoder():
+    """
+        Incremental receiver of raw depth frame uploads, chunks of any size are compressed as they arrive
+        so the uncompressed frame is never held in memory as a whole
+    """
+
+    # Initialize the decoder for one frame of height rows and width columns, zlib level 1 is fast and still
+    # compresses the smooth depth images to a fraction of their size
+    def __init__(self, width, height, dtype="uint16", level=1):
+        self.shape = (height, width)
+        self.dtype = np.dtype(dtype).name
+        self.frame_size = width * height * np.dtype(dtype).itemsize
+        self.compressor = zlib.compressobj(level)
+        self.parts = []
+        self.num_bytes = 0
+
+    # Compress the next chunk of the body
+    def feed(self, chunk):
+        self.num_bytes = self.num_bytes + len(chunk)
+        if self.num_bytes > self.frame_size:
+            raise FrameDecodeError("Request body is larger than one {}x{} {} frame of {} bytes".format(
+                self.shape[1], self.shape[0], self.dtype, self.frame_size))
+        self.parts.append(self.compressor.compress(chunk))
+
+    # Compressed frame after the last chunk
+    def finish(self):
+        if self.num_bytes != self.frame_size:
+            raise FrameDecodeError("Request body has {} bytes, one {}x{} {} frame has {} bytes".format(
+                self.num_bytes, self.shape[1], self.shape[0], self.dtype, self.frame_size))
+        self.parts.append(self.compressor.flush())
+        return b"".join(self.parts)
+
+    # Uncompressed frame buffer of a stored frame
+    @staticmethod
+    def decompress(data, compression="zlib"):
+        if compression != "zlib":
+            raise FrameDecodeError("Unknown frame compression {}".format(compression))
+        return zlib.decompress(data)
+
+    # NumPy view of an uncompressed frame buffer, the pixels are not copied and the array is read-only
+    @staticmethod
+    def to_array(buffer, shape, dtype):
+        return np.frombuffer(buffer, dtype=dtype).reshape(shape)
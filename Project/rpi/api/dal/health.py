@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, time
+import asyncio
+
+
+class DBHealthProbe():
+    """
+        Background MongoDB ping on an interval, health checks read the cached result instead of querying the DB
+    """
+
+    # Initialize the probe
+    def __init__(self, client, interval=5.0, timeout=2.0):
+        self.client = client
+        self.interval = interval
+        self.timeout = timeout
+        self.healthy = False
+        self.latency_ms = None
+        self.last_check = None
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.task = None
+
+    # Start pinging in the background
+    def start(self):
+        self.task = asyncio.create_task(self.run(), name="db-health-probe")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    # Ping the DB once and store the result, only changes of the state are logged at INFO level
+    async def check(self):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.client.admin.command("ping"), self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.healthy or self.last_check is None:
+                logging.error("!! DB health probe failed with error: {} !!".format(e))
+            self.healthy = False
+            self.latency_ms = None
+            self.last_error = str(e)
+            self.consecutive_failures = self.consecutive_failures + 1
+        else:
+            if not self.healthy:
+                logging.info("## DB health probe successful ##")
+            self.healthy = True
+            self.latency_ms = (time.perf_counter() - start) * 1e3
+            self.last_error = None
+            self.consecutive_failures = 0
+        self.last_check = time.time()
+
+    async def run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    # Check if the DB is reachable, a result older than three intervals means the probe itself is stuck
+    def is_ready(self):
+        return self.healthy and self.last_check is not None and time.time() - self.last_check < 3 * self.interval + self.timeout
+
+    # Cached state of the probe
+    def state(self):
+        return {
+            "healthy": self.is_ready(),
+            "latency_ms": self.latency_ms,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+        }
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging
+import asyncio
+from datetime import datetime, timezone
+from bson import Binary
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import BulkWriteError
+
+# Import local libraries
+from dal.dal import FrameDecoder, SampleDecodeError
+
+
+class MongoDAL():
+    """
+        MongoDB data access layer on top of the shared Motor client
+    """
+
+    # Collection of the experiments, documents are {"name": ..., "description": ..., "date": date, "stop": date}
+    EXPERIMENTS_COLLECTION = "experiments"
+
+    # Time-series collection of the sensor samples, documents are {"timestamp": date, "meta": {"experiment": ..., "sensor": ...}, "value": ...}
+    SENSOR_DATA_COLLECTION = "sensor_data"
+
+    # Collection of the depth frames, documents are {"timestamp": date, "meta": {"experiment": ..., "sensor": ...}, "shape": [rows, columns],
+    # "dtype": ..., "scale": meters per unit, "compression": "zlib", "size": compressed bytes} with the frame in "data" or in GridFS under "file_id"
+    DEPTH_FRAMES_COLLECTION = "depth_frames"
+    DEPTH_FRAMES_BUCKET = "depth_frames_fs"
+
+    # Compressed frames above this size always go to GridFS, documents are limited to 16 MB
+    MAX_INLINE_FRAME_SIZE = 15 * 1024 * 1024
+
+    # Initialize the DAL
+    def __init__(self, client):
+        self.client = client
+        self.db = client.get_default_database()
+        self.experiments = self.db[self.EXPERIMENTS_COLLECTION]
+        self.sensor_data = self.db[self.SENSOR_DATA_COLLECTION]
+        self.depth_frames = self.db[self.DEPTH_FRAMES_COLLECTION]
+        self.depth_frames_fs = AsyncIOMotorGridFSBucket(self.db, bucket_name=self.DEPTH_FRAMES_BUCKET)
+
+    # Get an experiment by name, None if it does not exist
+    async def get_experiment(self, name):
+        return await self.experiments.find_one({"name": name}, {"_id": 0})
+
+    # Create a running experiment, raises DuplicateKeyError if the name is taken
+    async def create_experiment(self, name, description):
+        await self.experiments.insert_one({"name": name, "description": description, "date": datetime.now(timezone.utc)})
+
+    # Stop a running experiment, returns False if it does not exist or is already stopped
+    async def stop_experiment(self, name):
+        result = await self.experiments.update_one({"name": name, "stop": {"$exists": False}},
+                                                   {"$set": {"stop": datetime.now(timezone.utc)}})
+        return result.modified_count == 1
+
+    # Filter of the samples of one sensor in one experiment between start and stop (datetimes, either may be None)
+    # Equality on both meta fields and a range on timestamp lets MongoDB use the bucket index of the time-series
+    # collection and the (meta.experiment, meta.sensor, timestamp) index, only the buckets in the range are unpacked
+    @staticmethod
+    def samples_filter(experiment, sensor=None, start=None, stop=None):
+        query = {"meta.experiment": experiment}
+        if sensor is not None:
+            query["meta.sensor"] = sensor
+        if start is not None or stop is not None:
+            query["timestamp"] = {}
+            if start is not None:
+                query["timestamp"]["$gte"] = start
+            if stop is not None:
+                query["timestamp"]["$lt"] = stop
+        return query
+
+    # Cursor over the samples of one sensor in timestamp order, only the timestamp and value are returned
+    def find_samples(self, experiment, sensor, start=None, stop=None, limit=0, batch_size=None):
+        cursor = self.sensor_data.find(self.samples_filter(experiment, sensor, start, stop),
+                                       {"_id": 0, "timestamp": 1, "value": 1},
+                                       sort=[("timestamp", 1)], limit=limit)
+        if batch_size is not None:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    # Cursor over the samples of one or all sensors of an experiment for exports, sorted by sensor and timestamp so the
+    # index provides the order and no in-memory sort is needed, batch_size sets the documents per round-trip
+    def export_samples(self, experiment, sensor=None, start=None, stop=None, batch_size=5000):
+        return self.sensor_data.find(self.samples_filter(experiment, sensor, start, stop),
+                                     {"_id": 0, "timestamp": 1, "meta.sensor": 1, "value": 1},
+                                     sort=[("meta.sensor", 1), ("timestamp", 1)], batch_size=batch_size)
+
+    # First and last timestamp of the samples of one sensor, both read from the ends of the index
+    async def find_time_range(self, experiment, sensor):
+        query = self.samples_filter(experiment, sensor)
+        first = await self.sensor_data.find_one(query, {"_id": 0, "timestamp": 1}, sort=[("timestamp", 1)])
+        last = await self.sensor_data.find_one(query, {"_id": 0, "timestamp": 1}, sort=[("timestamp", -1)])
+        if first is None:
+            return None, None
+        return first["timestamp"].replace(tzinfo=timezone.utc), last["timestamp"].replace(tzinfo=timezone.utc)
+
+    # Min/max/mean/sum/count of the samples of one sensor in buckets of bucket_ms milliseconds, computed by MongoDB
+    async def aggregate_samples(self, experiment, sensor, start, stop, bucket_ms):
+        pipeline = [
+            {"$match": self.samples_filter(experiment, sensor, start, stop)},
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$timestamp", "unit": "millisecond", "binSize": bucket_ms}},
+                "min": {"$min": "$value"},
+                "max": {"$max": "$value"},
+                "mean": {"$avg": "$value"},
+                "sum": {"$sum": "$value"},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]
+        buckets = []
+        async for bucket in self.sensor_data.aggregate(pipeline):
+            bucket["timestamp"] = bucket.pop("_id").replace(tzinfo=timezone.utc).timestamp()
+            buckets.append(bucket)
+        return buckets
+
+    # Insert a batch of sensor data documents unordered, a failing document does not stop the rest of the batch
+    async def insert_samples(self, documents):
+        try:
+            result = await self.sensor_data.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            logging.error("!! Inserting {} samples failed for {} of them !!".format(len(documents), len(e.details["writeErrors"])))
+            return e.details["nInserted"]
+        return len(result.inserted_ids)
+
+    # Insert the documents of a decoder fed from an async iterator of body chunks, on_batch is called with every batch
+    # Batches are inserted while the next batch is decoded, at most max_pending inserts are in flight
+    # A SampleDecodeError carries the batches inserted before the invalid sample in its batches attribute
+    async def ingest(self, decoder, chunks, batch_size=1000, max_pending=2, on_batch=None):
+        batches = []
+        pending = set()
+        batch = []
+
+        async def flush(batch):
+            if on_batch is not None:
+                on_batch(batch)
+            # Wait for a free insert slot before starting the next one
+            while len(pending) >= max_pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+            task = asyncio.ensure_future(self.insert_samples(batch))
+            pending.add(task)
+            batches.append((len(batch), task))
+
+        try:
+            async for chunk in chunks:
+                batch.extend(decoder.feed(chunk))
+                while len(batch) >= batch_size:
+                    await flush(batch[:batch_size])
+                    batch = batch[batch_size:]
+            batch.extend(decoder.feed(b"", final=True))
+            if batch:
+                await flush(batch)
+        except SampleDecodeError as e:
+            # Batches already sent are always completed, the client is told which samples were stored
+            if pending:
+                await asyncio.wait(pending)
+            e.batches = [{"received": received, "inserted": 0 if task.exception() else task.result()} for received, task in batches]
+            raise
+        finally:
+            if pending:
+                await asyncio.wait(pending)
+
+        return [{"received": received, "inserted": task.result()} for received, task in batches]
+
+    # Store a compressed depth frame as BSON Binary, frames larger than gridfs_threshold bytes are stored in GridFS
+    async def insert_frame(self, experiment, sensor, timestamp, data, shape, dtype, scale, gridfs_threshold=MAX_INLINE_FRAME_SIZE):
+        meta = {"experiment": experiment, "sensor": sensor}
+        document = {"timestamp": timestamp, "meta": meta, "shape": list(shape), "dtype": dtype, "scale": scale,
+                    "compression": "zlib", "size": len(data)}
+        if len(data) > min(gridfs_threshold, self.MAX_INLINE_FRAME_SIZE):
+            filename = "{}/{}/{}".format(experiment, sensor, timestamp.isoformat())
+            document["file_id"] = await self.depth_frames_fs.upload_from_stream(filename, data, metadata=meta)
+        else:
+            document["data"] = Binary(data)
+        result = await self.depth_frames.insert_one(document)
+        return result.inserted_id
+
+    # Cursor over the metadata of the depth frames of one sensor in timestamp order, without the frame data
+    def find_frames(self, experiment, sensor, start=None, stop=None, limit=0):
+        return self.depth_frames.find(self.samples_filter(experiment, sensor, start, stop), {"data": 0},
+                                      sort=[("timestamp", 1)], limit=limit)
+
+    # Get a depth frame document, None if it does not exist, frames stored in GridFS are only read by load_frame()
+    async def find_frame(self, experiment, sensor, frame_id):
+        return await self.depth_frames.find_one({"_id": frame_id, "meta.experiment": experiment, "meta.sensor": sensor})
+
+    # Uncompressed frame buffer of a depth frame document, FrameDecoder.to_array() turns it into a NumPy array without copying it
+    async def load_frame(self, document):
+        if "file_id" in document:
+            stream = await self.depth_frames_fs.open_download_stream(document["file_id"])
+            data = await stream.read()
+        else:
+            data = document["data"]
+        return FrameDecoder.decompress(data, document["compression"])
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import time, threading
+import asyncio
+from aiohttp import web
+from pymongo import monitoring
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric():
+    """
+        Base class of the metrics, values are kept per label value tuple and are safe to update from driver threads
+    """
+
+    TYPE = None
+
+    # Initialize the metric
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        # Labels of every series, e.g. the worker process of a multi-process server
+        self.const_labels = ()
+        # Series without labels exist from the start so they are exported as 0
+        if not self.labels and self.TYPE != "histogram":
+            self.values[()] = 0
+
+    # Render the label values of one series
+    def format_labels(self, values, extra=""):
+        pairs = ['{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                 for label, value in list(zip(self.labels, values)) + list(self.const_labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    # Render the metric in the Prometheus text format, series are the sample lines of the same metric of other workers
+    def render(self, series=()):
+        return ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.TYPE)] + self.series() + list(series)
+
+    # Sample lines of the metric without the HELP and TYPE lines
+    def series(self):
+        lines = []
+        with self.lock:
+            for values, value in self.values.items():
+                lines.append("{}{} {}".format(self.name, self.format_labels(values), value))
+        return lines
+
+
+class Counter(Metric):
+    """
+        Monotonic counter
+    """
+
+    TYPE = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+        Gauge that can go up and down
+    """
+
+    TYPE = "gauge"
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """
+        Histogram with fixed buckets, every series keeps its bucket counts, sum and count
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] = series[0][index] + 1
+                    break
+            series[1] = series[1] + value
+            series[2] = series[2] + 1
+
+    def series(self):
+        lines = []
+        with self.lock:
+            for values, (counts, total, count) in self.values.items():
+                # Bucket counts are cumulative in the text format
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative = cumulative + bucket_count
+                    lines.append("{}_bucket{} {}".format(self.name, self.format_labels(values, 'le="{}"'.format(bound)), cumulative))
+                lines.append("{}_bucket{} {}".format(self.name, self.format_labels(values, 'le="+Inf"'), count))
+                lines.append("{}_sum{} {}".format(self.name, self.format_labels(values), total))
+                lines.append("{}_count{} {}".format(self.name, self.format_labels(values), count))
+        return lines
+
+
+class MetricsRegistry():
+    """
+        Metrics of the API, HTTP requests through the middleware and MongoDB through the PyMongo event listeners
+    """
+
+    # Initialize the metrics, worker labels every series with the worker process of a multi-process server
+    def __init__(self, worker=None):
+        self.worker = worker
+        self.metrics = []
+
+        # HTTP requests
+        self.requests = self.add(Counter("rainsim_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")))
+        self.request_latency = self.add(Histogram("rainsim_http_request_duration_seconds", "HTTP request handling time by route and method", ("route", "method")))
+        self.requests_in_flight = self.add(Gauge("rainsim_http_requests_in_flight", "HTTP requests being handled"))
+
+        # Ingest throughput
+        self.ingest_received = self.add(Counter("rainsim_ingest_samples_received_total", "Samples received by the ingest route"))
+        self.ingest_inserted = self.add(Counter("rainsim_ingest_samples_inserted_total", "Samples inserted by the ingest route"))
+        self.ingest_batches = self.add(Counter("rainsim_ingest_batches_total", "insert_many batches of the ingest route"))
+
+        # Depth frame uploads, raw and compressed sizes give the compression ratio
+        self.frames_received = self.add(Counter("rainsim_frames_received_total", "Depth frames received by the frame upload route"))
+        self.frame_bytes_received = self.add(Counter("rainsim_frame_bytes_received_total", "Uncompressed bytes of the uploaded depth frames"))
+        self.frame_bytes_stored = self.add(Counter("rainsim_frame_bytes_stored_total", "Compressed bytes of the stored depth frames"))
+
+        # MongoDB commands
+        self.db_commands = self.add(Counter("rainsim_db_commands_total", "MongoDB commands by command name and outcome", ("command", "outcome")))
+        self.db_command_latency = self.add(Histogram("rainsim_db_command_duration_seconds", "MongoDB command round-trip time by command name", ("command",)))
+
+        # MongoDB connection pool
+        self.db_connections = self.add(Gauge("rainsim_db_pool_connections", "Open connections of the MongoDB pool by server", ("address",)))
+        self.db_checked_out = self.add(Gauge("rainsim_db_pool_checked_out_connections", "Connections checked out of the MongoDB pool by server", ("address",)))
+        self.db_checkout_wait = self.add(Histogram("rainsim_db_pool_checkout_wait_seconds", "Time waited for a MongoDB pool connection by server", ("address",)))
+        self.db_checkout_failures = self.add(Counter("rainsim_db_pool_checkout_failures_total", "Failed MongoDB pool check-outs by server and reason", ("address", "reason")))
+
+    def add(self, metric):
+        if self.worker is not None:
+            metric.const_labels = (("worker", self.worker),)
+        self.metrics.append(metric)
+        return metric
+
+    # Sample lines of all metrics by metric name, the part of a scrape that other workers add to theirs
+    def series(self):
+        return {metric.name: metric.series() for metric in self.metrics}
+
+    # Prometheus text format of all metrics, peer_series are the series() of the other workers
+    def render(self, peer_series=()):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render([line for series in peer_series for line in series.get(metric.name, [])]))
+        return "\n".join(lines) + "\n"
+
+    # Middleware counting and timing the requests, routes are labelled by their template so the label set stays small
+    # Requests cancelled because the client disconnected are counted with status 499 like in nginx, WebSocket sessions
+    # end this way when the client goes away and are counted with the 101 they were answered with, so the 5xx series
+    # only counts server errors. WebSocket sessions last minutes to hours and are left out of the latency histogram
+    @web.middleware
+    async def middleware(self, request, handler):
+        route = request.match_info.route.resource
+        route = route.canonical if route is not None else "unmatched"
+        self.requests_in_flight.inc()
+        start = time.perf_counter()
+        status = 500
+        session = False
+        try:
+            response = await handler(request)
+            status = response.status
+            session = isinstance(response, web.WebSocketResponse)
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        except asyncio.CancelledError:
+            session = request.headers.get("Upgrade", "").lower() == "websocket"
+            status = 101 if session else 499
+            raise
+        finally:
+            self.requests_in_flight.dec()
+            if not session:
+                self.request_latency.observe(time.perf_counter() - start, (route, request.method))
+            self.requests.inc((route, request.method, status))
+
+    # PyMongo event listeners to pass to the client with event_listeners
+    def listeners(self):
+        return [CommandMetricsListener(self), PoolMetricsListener(self)]
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+        PyMongo command listener recording the command latencies
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.registry.db_commands.inc((event.command_name, "success"))
+        self.registry.db_command_latency.observe(event.duration_micros / 1e6, (event.command_name,))
+
+    def failed(self, event):
+        self.registry.db_commands.inc((event.command_name, "failure"))
+        self.registry.db_command_latency.observe(event.duration_micros / 1e6, (event.command_name,))
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+        PyMongo connection pool listener recording the pool usage and the check-out wait times
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        # Start times of the pending check-outs by server and thread, the driver checks out a connection in the thread
+        # running the operation and sends the started and the completed event of one check-out from that thread
+        self.checkout_starts = {}
+        self.lock = threading.Lock()
+
+    def address(self, event):
+        return "{}:{}".format(*event.address)
+
+    # Wait time of a completed check-out, newer drivers report it on the event
+    def checkout_wait(self, event):
+        with self.lock:
+            start = self.checkout_starts.pop((event.address, threading.get_ident()), None)
+        duration = getattr(event, "duration", None)
+        if duration is None and start is not None:
+            duration = time.perf_counter() - start
+        return duration
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.registry.db_connections.inc((self.address(event),))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.registry.db_connections.dec((self.address(event),))
+
+    def connection_check_out_started(self, event):
+        with self.lock:
+            self.checkout_starts[(event.address, threading.get_ident())] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self.checkout_wait(event)
+        self.registry.db_checkout_failures.inc((self.address(event), event.reason))
+
+    def connection_checked_out(self, event):
+        duration = self.checkout_wait(event)
+        if duration is not None:
+            self.registry.db_checkout_wait.observe(duration, (self.address(event),))
+        self.registry.db_checked_out.inc((self.address(event),))
+
+    def connection_checked_in(self, event):
+        self.registry.db_checked_out.dec((self.address(event),))
@@ -3,6 +3,7 @@
 # Import general libraries
 import logging
 import asyncio
+from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
 
 
@@ -11,6 +12,13 @@ class MigrationsManager():
         Migrations class for managing MongoDB migrations
     """
 
+    # Migrations in the order they are applied, the applied versions are stored in the migrations collection
+    MIGRATIONS = [
+        (1, "create_experiments_table"),
+        (2, "create_sensor_data_table"),
+        (3, "create_depth_camera_table"),
+    ]
+
     # Initialize migrations
     def __init__(self, connection_string):
         logging.info("## Initializing migrations... ##")
@@ -37,14 +45,51 @@ class MigrationsManager():
         # Close the client
         self.client.close()
 
-    async def create_migrations_table(self):
+    async def create_migrations_table(self, db, collections):
         logging.info("## Creating Migrations table... ##")
+        if "migrations" not in collections:
+            await db.create_collection("migrations")
+        await db["migrations"].create_index("version", unique=True)
 
-    async def create_experiments_table(self):
+    async def create_experiments_table(self, db, collections):
         logging.info("## Creating Experiments table... ##")
+        # The collection itself is created with its validator by init-mongo.js
+        if "experiments" not in collections:
+            await db.create_collection("experiments")
+        await db["experiments"].create_index("name", unique=True)
+
+    async def create_sensor_data_table(self, db, collections):
+        logging.info("## Creating Sensor Data table... ##")
+        # Native time-series collection, samples of one experiment and sensor are stored compressed in time buckets
+        if "sensor_data" not in collections:
+            await db.create_collection("sensor_data", timeseries={
+                "timeField": "timestamp",
+                "metaField": "meta",
+                "granularity": "seconds",
+            })
+        # Time-range queries of one sensor in one experiment, see MongoDAL.find_samples()
+        await db["sensor_data"].create_index([("meta.experiment", 1), ("meta.sensor", 1), ("timestamp", 1)])
 
-    async def create_depth_camera_table(self):
+    async def create_depth_camera_table(self, db, collections):
         logging.info("## Creating Depth Camera table... ##")
+        # Regular collection, the compressed frames are too large for time-series buckets and are fetched by id
+        # Frames larger than the inline limit are stored in the depth_frames_fs GridFS bucket, see MongoDAL.insert_frame()
+        if "depth_frames" not in collections:
+            await db.create_collection("depth_frames")
+        await db["depth_frames"].create_index([("meta.experiment", 1), ("meta.sensor", 1), ("timestamp", 1)])
+
+    # Apply the migrations newer than the last applied version
+    async def apply_migrations(self, db):
+        collections = await db.list_collection_names()
+        await self.create_migrations_table(db, collections)
+
+        applied = {migration["version"] async for migration in db["migrations"].find({}, {"version": 1})}
+        for version, name in self.MIGRATIONS:
+            if version in applied:
+                continue
+            logging.info("## Applying migration {}: {} ##".format(version, name))
+            await getattr(self, name)(db, collections)
+            await db["migrations"].insert_one({"version": version, "name": name, "applied": datetime.now(timezone.utc)})
 
 
     # Migrate DB schema
@@ -70,11 +115,10 @@ class MigrationsManager():
             else:
 
                 try:
-                    # List collections
-                    collections = await db.list_collection_names()
-                    logging.info("Collections: {}".format(collections))
+                    # Apply the missing migrations
+                    await self.apply_migrations(db)
                 except Exception as e:
-                    logging.error("Error listing collections: {}".format(e))
+                    logging.error("!! Error applying migrations: {}".format(e))
                     await self.disconnect()
                     return False
             
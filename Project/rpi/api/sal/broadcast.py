@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, json
+import asyncio
+from collections import deque
+
+
+class BroadcastClient():
+    """
+        WebSocket client of the broadcaster with a bounded send queue, a slow client loses its oldest messages
+    """
+
+    # Initialize the client, peer clients are the relay links of the other worker processes
+    def __init__(self, ws, queue_size=32, max_dropped=256, peer=False):
+        self.ws = ws
+        self.peer = peer
+        self.queue = deque(maxlen=queue_size)
+        # A client that dropped max_dropped messages since its last successful send is disconnected
+        self.max_dropped = max_dropped
+        self.dropped = 0
+        self.topics = set()
+        self.event = asyncio.Event()
+        self.sender = None
+
+    def start(self):
+        self.sender = asyncio.create_task(self.send_loop())
+
+    # Stop sending, a send blocked on a stalled connection is cancelled
+    async def stop(self):
+        self.sender.cancel()
+        await asyncio.gather(self.sender, return_exceptions=True)
+
+    # Queue a message, when the queue is full the oldest message is dropped so the client catches up with the latest
+    def offer(self, message):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped = self.dropped + 1
+            if self.dropped == self.max_dropped:
+                logging.warning("!! Closing slow WebSocket client, {} messages dropped !!".format(self.dropped))
+                self.sender.cancel()
+                asyncio.ensure_future(self.ws.close(message=b"Too slow"))
+        self.queue.append(message)
+        self.event.set()
+
+    # Send the queued messages until the client disconnects
+    async def send_loop(self):
+        while True:
+            await self.event.wait()
+            self.event.clear()
+            while self.queue:
+                await self.ws.send_str(self.queue.popleft())
+                self.dropped = 0
+
+
+class Broadcaster():
+    """
+        Topic based fan-out of sample batches to WebSocket clients, every batch is encoded once for all subscribers
+    """
+
+    # Initialize the broadcaster
+    def __init__(self, queue_size=32, max_dropped=256):
+        self.queue_size = queue_size
+        self.max_dropped = max_dropped
+        # Topic "experiment/sensor" or wildcard "experiment/*" to its subscribed clients
+        self.subscriptions = {}
+        self.clients = set()
+        # Called when the topics of the local clients change, see WorkerPeers.sync_topics()
+        self.on_topics_changed = None
+
+    # Check if a topic has any subscribers before encoding a batch for it
+    def has_subscribers(self, topic):
+        return topic in self.subscriptions or topic.split("/", 1)[0] + "/*" in self.subscriptions
+
+    # Topics with at least one subscriber that is not a peer worker
+    def local_topics(self):
+        return {topic for topic, clients in self.subscriptions.items() if any(not client.peer for client in clients)}
+
+    # Encode a batch of [timestamp, value] samples once and queue it for every subscriber of the topic
+    def publish(self, topic, samples):
+        if not self.has_subscribers(topic):
+            return 0
+        return self.deliver(topic, json.dumps({"topic": topic, "samples": samples}))
+
+    # Queue an encoded message for the subscribers of the topic, messages relayed by a peer are not sent to the peers again
+    def deliver(self, topic, message, peers=True):
+        clients = self.subscriptions.get(topic, set()) | self.subscriptions.get(topic.split("/", 1)[0] + "/*", set())
+        clients = [client for client in clients if peers or not client.peer]
+        for client in clients:
+            client.offer(message)
+        return len(clients)
+
+    def subscribe(self, client, topic):
+        self.subscriptions.setdefault(topic, set()).add(client)
+        client.topics.add(topic)
+        self.topics_changed(client)
+
+    def unsubscribe(self, client, topic):
+        clients = self.subscriptions.get(topic)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del self.subscriptions[topic]
+        client.topics.discard(topic)
+        self.topics_changed(client)
+
+    def topics_changed(self, client):
+        if self.on_topics_changed is not None and not client.peer:
+            self.on_topics_changed()
+
+    # Serve one WebSocket connection, clients send {"subscribe": [topics]} and {"unsubscribe": [topics]}
+    async def serve(self, ws, peer=False):
+        client = BroadcastClient(ws, self.queue_size, self.max_dropped, peer)
+        self.clients.add(client)
+        client.start()
+        try:
+            async for message in ws:
+                try:
+                    request = json.loads(message.data)
+                    for topic in request.get("subscribe", []):
+                        self.subscribe(client, str(topic))
+                    for topic in request.get("unsubscribe", []):
+                        self.unsubscribe(client, str(topic))
+                except (ValueError, TypeError, AttributeError):
+                    await ws.send_str(json.dumps({"error": "Expected {\"subscribe\": [topics]} or {\"unsubscribe\": [topics]}"}))
+        finally:
+            for topic in list(client.topics):
+                self.unsubscribe(client, topic)
+            self.clients.discard(client)
+            await client.stop()
+
+    # Close all clients on shutdown
+    async def close(self):
+        for client in list(self.clients):
+            await client.ws.close(message=b"Server shutdown")
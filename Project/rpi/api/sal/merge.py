@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, heapq
+import asyncio
+from collections import deque, namedtuple
+
+# Import local libraries
+from sal.sal import Sensor
+
+# Multi-sensor record aligned on the timestamp of a primary sensor sample, values are keyed by sensor id
+AlignedRecord = namedtuple("AlignedRecord", ["timestamp", "values"])
+
+
+class StreamMerger():
+    """
+        Timestamp-ordered k-way merge of live sensor streams, a heap holds the head sample of every stream
+    """
+
+    # Initialize the merger from sensors or async iterables of sample batches
+    def __init__(self, sources, max_lateness=0.5, max_buffered=10000):
+        self.sources = [source.batches() if isinstance(source, Sensor) else source for source in sources]
+        # Wall clock seconds an empty stream is waited for before the other streams are merged past it
+        self.max_lateness = max_lateness
+        # A stream whose clock runs ahead of the others keeps at most max_buffered samples, its oldest samples are dropped
+        self.buffers = [deque(maxlen=max_buffered) for _ in self.sources]
+        self.dropped_samples = 0
+        self.empty_since = [None for _ in self.sources]
+        self.finished = [False for _ in self.sources]
+        # Heap of (timestamp, stream index, sample), at most one entry per stream
+        self.heap = []
+        self.in_heap = [False for _ in self.sources]
+        # Streams without a head on the heap, only these are checked before emitting a sample
+        self.waiting = set(range(len(self.sources)))
+        self.last_timestamp = float("-inf")
+        self.late_samples = 0
+        self.event = asyncio.Event()
+
+    # Copy the batches of one stream into its buffer
+    async def pump(self, index):
+        try:
+            buffer = self.buffers[index]
+            async for batch in self.sources[index]:
+                self.dropped_samples = self.dropped_samples + max(len(buffer) + len(batch) - buffer.maxlen, 0)
+                buffer.extend(batch)
+                self.event.set()
+        finally:
+            self.finished[index] = True
+            self.event.set()
+
+    # Move the next sample of a stream onto the heap, samples older than the merged output are dropped
+    def push_head(self, index):
+        buffer = self.buffers[index]
+        while buffer:
+            sample = buffer.popleft()
+            if sample.timestamp < self.last_timestamp:
+                self.late_samples = self.late_samples + 1
+                continue
+            heapq.heappush(self.heap, (sample.timestamp, index, sample))
+            self.in_heap[index] = True
+            self.empty_since[index] = None
+            self.waiting.discard(index)
+            return
+        if self.empty_since[index] is None:
+            self.empty_since[index] = asyncio.get_running_loop().time()
+        self.waiting.add(index)
+
+    # Check if the heap minimum can be emitted, every stream has a head or has been empty for longer than max_lateness
+    def is_ready(self, now):
+        for index in list(self.waiting):
+            self.push_head(index)
+            if index in self.waiting and not self.finished[index] and now - self.empty_since[index] < self.max_lateness:
+                return False
+        return True
+
+    # Time until the first waiting stream is given up on
+    def next_deadline(self, now):
+        waiting = [self.empty_since[index] for index in self.waiting if not self.finished[index]]
+        return max(min(waiting) + self.max_lateness - now, 0) if waiting else None
+
+    # Merged samples in timestamp order
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        tasks = [asyncio.create_task(self.pump(index)) for index in range(len(self.sources))]
+        self.empty_since = [loop.time() for _ in self.sources]
+        try:
+            while True:
+                self.event.clear()
+                for index in list(self.waiting):
+                    self.push_head(index)
+
+                now = loop.time()
+                while self.heap and self.is_ready(now):
+                    timestamp, index, sample = heapq.heappop(self.heap)
+                    self.in_heap[index] = False
+                    self.last_timestamp = timestamp
+                    self.push_head(index)
+                    yield sample
+
+                if not self.heap and all(self.finished) and not any(self.buffers):
+                    return
+
+                # Wait for new samples or until a late stream is given up on
+                try:
+                    await asyncio.wait_for(self.event.wait(), self.next_deadline(loop.time()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.late_samples or self.dropped_samples:
+                logging.warning("!! Stream merger dropped {} late and {} overflowing samples !!".format(self.late_samples, self.dropped_samples))
+
+
+# As-of join of a merged stream, every primary sample is aligned with the latest earlier value of every other sensor
+async def asof_join(merged, primary, tolerance=None):
+    latest = {}
+    samples = merged.__aiter__()
+    try:
+        async for sample in samples:
+            if sample.sensor_id != primary:
+                latest[sample.sensor_id] = (sample.timestamp, sample.value)
+                continue
+
+            # Values older than the tolerance are left out of the record
+            values = {sensor_id: value for sensor_id, (timestamp, value) in latest.items()
+                      if tolerance is None or sample.timestamp - timestamp <= tolerance}
+            values[primary] = sample.value
+            yield AlignedRecord(sample.timestamp, values)
+    finally:
+        # Closing the join stops the merger and its subscriptions
+        await samples.aclose()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, time
+import asyncio
+from urllib.parse import urlparse, parse_qs
+
+# Import local libraries
+from sal.sal import Sample, Sensor
+
+
+class RainGauge(Sensor):
+    """
+        Rain gauge reader for a serial or TCP stream with one reading per line, readings are delivered in micro-batches
+    """
+
+    # Initialize the rain gauge
+    def __init__(self, sensor_id, url, batch_size=256, batch_interval_ms=100, chunk_size=65536, max_line_length=256, **kwargs):
+        super().__init__(sensor_id, **kwargs)
+        # Stream address, either tcp://host:port or serial:///dev/ttyUSB0?baudrate=9600
+        self.url = url
+        # A batch is delivered after batch_size samples or batch_interval_ms after its first sample
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval_ms / 1e3
+        self.chunk_size = chunk_size
+        self.max_line_length = max_line_length
+        self.reader = None
+        self.writer = None
+        # Incomplete line at the end of the last chunk and samples that did not fit into the last batch
+        self.partial_line = b""
+        self.pending = []
+
+    # Connect to the rain gauge stream, done on the first read so a missing gauge is retried by the read loop
+    async def connect(self):
+        url = urlparse(self.url)
+        logging.info("## Connecting to rain gauge {} at {}... ##".format(self.sensor_id, self.url))
+
+        if url.scheme == "tcp":
+            self.reader, self.writer = await asyncio.open_connection(url.hostname, url.port)
+        elif url.scheme == "serial":
+            # Serial support is optional, only needed when a gauge is connected directly
+            try:
+                import serial_asyncio
+            except ImportError:
+                raise RuntimeError("pyserial-asyncio is required for serial rain gauges, install the serial extra")
+            baudrate = int(parse_qs(url.query).get("baudrate", ["9600"])[0])
+            self.reader, self.writer = await serial_asyncio.open_serial_connection(url=url.path, baudrate=baudrate)
+        else:
+            raise ValueError("Unsupported rain gauge URL: {}".format(self.url))
+
+        self.partial_line = b""
+
+    # Disconnect from the rain gauge stream
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    # Parse the complete lines of a chunk, every sample of the chunk is timestamped at its arrival
+    def parse_chunk(self, chunk, timestamp):
+        lines = (self.partial_line + chunk).split(b"\n")
+        self.partial_line = lines.pop()
+        if len(self.partial_line) > self.max_line_length:
+            logging.warning("!! Rain gauge {} line too long, discarding it !!".format(self.sensor_id))
+            self.partial_line = b""
+
+        samples = []
+        for line in lines:
+            try:
+                samples.append(Sample(timestamp, self.sensor_id, float(line)))
+            except ValueError:
+                # Empty lines and garbage after reconnecting
+                if line.strip():
+                    logging.debug("## Rain gauge {} skipped invalid line: {} ##".format(self.sensor_id, line))
+        return samples
+
+    # Read the next micro-batch
+    async def read(self):
+        # Reconnect after a failed read
+        if self.reader is None:
+            await self.connect()
+
+        loop = asyncio.get_running_loop()
+        batch = self.pending
+        deadline = loop.time() + self.batch_interval if batch else None
+
+        while len(batch) < self.batch_size:
+            # Wait without a timeout until the first sample of the batch arrives
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(self.chunk_size), timeout)
+            except asyncio.TimeoutError:
+                break
+            except OSError:
+                await self.close()
+                raise
+
+            if not chunk:
+                await self.close()
+                raise ConnectionError("Rain gauge {} connection closed".format(self.sensor_id))
+
+            batch.extend(self.parse_chunk(chunk, time.time()))
+            if batch and deadline is None:
+                deadline = loop.time() + self.batch_interval
+
+        # Samples that do not fit are delivered with the next batch
+        self.pending = batch[self.batch_size:]
+        return batch[:self.batch_size]
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, time, threading
+import asyncio
+import numpy as np
+
+# Import local libraries
+from sal.sal import Sample, Sensor
+
+
+class RealSenseSensor(Sensor):
+    """
+        RealSense depth camera adapter, frames are captured on a dedicated thread into a fixed-size frame stack
+    """
+
+    # Initialize the depth camera, the sample buffer keeps only a few seconds of the frame stream and no
+    # downsampled views since every sample is a frame, capture_timeout is added to the capture time of the averages
+    def __init__(self, sensor_id, width=640, height=480, fps=30, stack_size=30, stream_fps=5, downsample=4, capture_timeout=5.0, **kwargs):
+        kwargs.setdefault("buffer_size", 32)
+        kwargs.setdefault("resolutions", ())
+        super().__init__(sensor_id, **kwargs)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        # Rate and stride of the downsampled frame stream delivered to subscribers
+        self.stream_fps = stream_fps
+        self.downsample = downsample
+        self.capture_timeout = capture_timeout
+
+        # Preallocated stack of the last depth frames, the only frame memory the adapter uses
+        self.stack_size = stack_size
+        self.frames = np.zeros((stack_size, height, width), dtype=np.uint16)
+        self.timestamps = np.zeros(stack_size)
+        self.num_frames = 0
+        self.lock = threading.Lock()
+
+        self.pipeline = None
+        self.depth_scale = None
+        self.baseline = None
+        self.is_capturing = False
+        self.thread = None
+
+    # Start the camera pipeline and the capture thread
+    async def open(self):
+        # The RealSense driver is only needed when a camera is configured
+        import pyrealsense2 as rs
+
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, self.fps)
+
+        # Starting the pipeline blocks until the camera is ready
+        loop = asyncio.get_running_loop()
+        profile = await loop.run_in_executor(None, self.pipeline.start, config)
+        self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+
+        self.is_capturing = True
+        self.thread = threading.Thread(target=self.capture, name="sensor-{}".format(self.sensor_id), daemon=True)
+        self.thread.start()
+
+    # Stop the capture thread and the camera pipeline
+    async def close(self):
+        self.is_capturing = False
+        if self.thread is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+            self.thread = None
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+    # Capture loop running on the dedicated thread
+    def capture(self):
+        while self.is_capturing:
+            try:
+                frames = self.pipeline.wait_for_frames(1000)
+            except RuntimeError as e:
+                logging.error("!! Depth camera {} capture failed with error: {} !!".format(self.sensor_id, e))
+                continue
+
+            depth_frame = frames.get_depth_frame()
+            with self.lock:
+                index = self.num_frames % self.stack_size
+                self.frames[index] = np.asanyarray(depth_frame.get_data())
+                self.timestamps[index] = time.time()
+                self.num_frames = self.num_frames + 1
+
+    # Get a copy of the latest frame and its timestamp
+    def latest_frame(self, downsample=1):
+        with self.lock:
+            if self.num_frames == 0:
+                return None, None
+            index = (self.num_frames - 1) % self.stack_size
+            return self.timestamps[index], self.frames[index, ::downsample, ::downsample].copy()
+
+    # Deliver the downsampled frame stream
+    async def read(self):
+        await asyncio.sleep(1 / self.stream_fps)
+        timestamp, frame = self.latest_frame(self.downsample)
+        if frame is None:
+            return []
+        return [Sample(timestamp, self.sensor_id, frame)]
+
+    # Average the last frames of the stack, ignoring invalid (zero) pixels
+    def average_frames(self, num_frames):
+        with self.lock:
+            last = self.num_frames % self.stack_size
+            indices = [(last - i - 1) % self.stack_size for i in range(num_frames)]
+            stack = self.frames[indices]
+        depth_sum = stack.sum(axis=0, dtype=np.float64)
+        valid_count = np.count_nonzero(stack, axis=0)
+        return np.divide(depth_sum, valid_count, out=np.zeros(depth_sum.shape), where=valid_count > 0)
+
+    # Capture the average of the next num_frames frames, raises asyncio.TimeoutError when the capture stalls
+    async def capture_average(self, num_frames=10):
+        if self.thread is None:
+            raise RuntimeError("Depth camera {} is not running".format(self.sensor_id))
+        num_frames = max(1, min(num_frames, self.stack_size))
+
+        # Wait for fresh frames instead of averaging frames captured before the request
+        start = self.num_frames
+        async def wait_for_frames():
+            while self.num_frames - start < num_frames:
+                await asyncio.sleep(1 / self.fps)
+        await asyncio.wait_for(wait_for_frames(), num_frames / self.fps + self.capture_timeout)
+
+        # Averaging a frame stack takes a few milliseconds, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.average_frames, num_frames)
+
+    # Capture the baseline for the volume calculation
+    async def capture_baseline(self, num_frames=10):
+        self.baseline = await self.capture_average(num_frames)
+        return self.baseline
+
+    # Capture the final frame and calculate the volume change against the baseline in liters
+    async def capture_volume_change(self, num_frames=10, roi=None):
+        if self.baseline is None:
+            raise RuntimeError("Depth camera {} has no baseline".format(self.sensor_id))
+        final = await self.capture_average(num_frames)
+
+        # Difference in meters, pixels invalid in either frame are ignored
+        difference = np.where((self.baseline > 0) & (final > 0), self.baseline - final, 0) * self.depth_scale
+        if roi is not None:
+            x, y, w, h = roi
+            difference = difference[y:y + h, x:x + w]
+        return float(np.sum(difference) / 1e3)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, time, json, importlib
+import asyncio
+import numpy as np
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Timestamped sensor sample, timestamp is in seconds since the epoch
+Sample = namedtuple("Sample", ["timestamp", "sensor_id", "value"])
+
+
+class DownsampledView():
+    """
+        Min/max/sum/count buckets of one resolution, bucket n covers [n * width, (n + 1) * width) and is stored at slot n % capacity
+        Queries merge whole buckets, the returned buckets start at a multiple of width
+    """
+
+    # Initialize the view with preallocated bucket arrays
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.mins = np.empty(capacity)
+        self.maxs = np.empty(capacity)
+        self.sums = np.zeros(capacity)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.newest = -1
+
+    # Add a batch of timestamps and values, vectorized over the batch
+    def extend(self, timestamps, values):
+        ids = (timestamps // self.width).astype(np.int64)
+        slots = ids % self.capacity
+
+        # Slots still holding an older bucket are reset, samples older than their slot are dropped
+        stale = self.ids[slots] < ids
+        if stale.any():
+            reset = slots[stale]
+            self.ids[reset] = ids[stale]
+            self.mins[reset] = np.inf
+            self.maxs[reset] = -np.inf
+            self.sums[reset] = 0
+            self.counts[reset] = 0
+        current = self.ids[slots] == ids
+        if not current.all():
+            slots, values = slots[current], values[current]
+
+        np.minimum.at(self.mins, slots, values)
+        np.maximum.at(self.maxs, slots, values)
+        self.sums += np.bincount(slots, values, minlength=self.capacity)
+        self.counts += np.bincount(slots, minlength=self.capacity)
+        self.newest = max(self.newest, int(ids.max()))
+
+    # Check if the view still holds the bucket of a timestamp
+    def covers(self, timestamp):
+        return timestamp // self.width > self.newest - self.capacity
+
+    # Merge the buckets between start and stop into at most points buckets
+    def query(self, start, stop, points):
+        if not (np.isfinite(start) and np.isfinite(stop)) or stop <= start or points < 1:
+            return []
+        start_id = int(start // self.width)
+        stop_id = int(np.ceil(stop / self.width)) - 1
+        ids = np.arange(max(start_id, self.newest - self.capacity + 1), stop_id + 1)
+        slots = ids % self.capacity
+        valid = self.ids[slots] == ids
+        ids, slots = ids[valid], slots[valid]
+        if ids.size == 0:
+            return []
+
+        # Output buckets are aligned to the buckets of the view and merge the same number of them, an output bucket
+        # never takes part of a view bucket so neighbouring points aggregate the same time
+        per_point = max(int(np.ceil((stop - start) / points / self.width)), 1)
+        while (stop_id - start_id) // per_point + 1 > points:
+            per_point = per_point + 1
+        span = per_point * self.width
+        start = start_id * self.width
+        out = (ids - start_id) // per_point
+        mins = np.full(points, np.inf)
+        maxs = np.full(points, -np.inf)
+        np.minimum.at(mins, out, self.mins[slots])
+        np.maximum.at(maxs, out, self.maxs[slots])
+        sums = np.bincount(out, self.sums[slots], minlength=points)
+        counts = np.bincount(out, self.counts[slots], minlength=points)
+
+        # Empty output buckets are left out
+        filled = np.flatnonzero(counts)
+        return [{"timestamp": timestamp, "min": low, "max": high, "mean": mean, "count": count}
+                for timestamp, low, high, mean, count in zip((start + filled * span).tolist(), mins[filled].tolist(), maxs[filled].tolist(),
+                                                             (sums[filled] / counts[filled]).tolist(), counts[filled].astype(np.int64).tolist())]
+
+
+class RingBuffer():
+    """
+        Bounded ring buffer of the latest sensor samples with downsampled views of the scalar samples
+    """
+
+    # Initialize the ring buffer, every resolution in seconds keeps view_capacity buckets
+    def __init__(self, capacity, resolutions=(1, 10, 60, 600), view_capacity=3600):
+        self.capacity = capacity
+        self.samples = deque(maxlen=capacity)
+        self.views = [DownsampledView(width, view_capacity) for width in sorted(resolutions)]
+        self.last_timestamp = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    # Add a batch of samples, the oldest samples are dropped when full
+    def extend(self, batch):
+        self.samples.extend(batch)
+        if not batch:
+            return
+        self.last_timestamp = batch[-1].timestamp
+
+        # Only scalar samples are downsampled, frames and other arrays are kept in the buffer only
+        if isinstance(batch[0].value, (int, float)):
+            timestamps = np.fromiter((sample.timestamp for sample in batch), dtype=np.float64, count=len(batch))
+            values = np.fromiter((sample.value for sample in batch), dtype=np.float64, count=len(batch))
+            for view in self.views:
+                view.extend(timestamps, values)
+
+    # Get at most points min/max/mean buckets between start and stop, the cost depends on points and not on the samples
+    def downsample(self, start, stop, points):
+        if not self.views or not (np.isfinite(start) and np.isfinite(stop)) or stop <= start or points < 1:
+            return []
+        # Coarsest view with at least points buckets in the range, finer views are used when coarser ones are too coarse
+        span = (stop - start) / points
+        candidates = [view for view in self.views if view.covers(start)] or self.views[-1:]
+        fitting = [view for view in candidates if view.width <= span]
+        view = fitting[-1] if fitting else candidates[0]
+        return view.query(start, stop, points)
+
+    # Get the latest n samples (all when n is None) in timestamp order
+    def latest(self, n=None):
+        if n is None or n >= len(self.samples):
+            return list(self.samples)
+        return list(self.samples)[-n:]
+
+
+class Sensor():
+    """
+        Base class for asynchronous sensors, subclasses implement read() that returns a batch of samples
+    """
+
+    # Initialize the sensor
+    def __init__(self, sensor_id, buffer_size=4096, queue_size=64, retry_delay=1.0, resolutions=(1, 10, 60, 600), view_capacity=3600):
+        self.sensor_id = sensor_id
+        self.buffer = RingBuffer(buffer_size, resolutions, view_capacity)
+        self.queue_size = queue_size
+        self.retry_delay = retry_delay
+        self.subscribers = set()
+        self.task = None
+
+    # Open the sensor and start the read loop
+    async def start(self):
+        logging.info("## Starting sensor {}... ##".format(self.sensor_id))
+        await self.open()
+        self.task = asyncio.create_task(self.run(), name="sensor-{}".format(self.sensor_id))
+
+    # Stop the read loop, close the sensor and end all subscriptions
+    async def stop(self):
+        logging.info("## Stopping sensor {}... ##".format(self.sensor_id))
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.close()
+        for queue in list(self.subscribers):
+            self.offer(queue, None)
+
+    # Hooks for subclasses to acquire and release the sensor
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # Read the next batch of samples, must not block the event loop
+    async def read(self):
+        raise NotImplementedError
+
+    # Read loop, a failing read is logged and retried so one sensor never stops the API
+    async def run(self):
+        while True:
+            try:
+                batch = await self.read()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("!! Sensor {} read failed with error: {} !!".format(self.sensor_id, e))
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            if batch:
+                self.publish(batch)
+
+    # Store a batch in the ring buffer and hand it to every subscriber
+    def publish(self, batch):
+        self.buffer.extend(batch)
+        for queue in self.subscribers:
+            self.offer(queue, batch)
+
+    # Put a batch into a bounded subscriber queue, slow subscribers lose their oldest batch
+    @staticmethod
+    def offer(queue, batch):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(batch)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    # Async iterator of sample batches
+    async def batches(self):
+        queue = self.subscribe()
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            self.unsubscribe(queue)
+
+    # Async iterator of single samples
+    async def samples(self):
+        async for batch in self.batches():
+            for sample in batch:
+                yield sample
+
+    def __aiter__(self):
+        return self.samples()
+
+
+class BlockingSensor(Sensor):
+    """
+        Base class for sensors with blocking drivers, subclasses implement read_blocking() that runs in the sensor executor
+    """
+
+    # Initialize the sensor with its own single thread executor so a slow driver only stalls itself
+    def __init__(self, sensor_id, **kwargs):
+        super().__init__(sensor_id, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sensor-{}".format(sensor_id))
+
+    # Read one value from the driver, may block
+    def read_blocking(self):
+        raise NotImplementedError
+
+    async def read(self):
+        loop = asyncio.get_running_loop()
+        value = await loop.run_in_executor(self.executor, self.read_blocking)
+        return [Sample(time.time(), self.sensor_id, value)]
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class SensorRegistry():
+    """
+        Registry of the sensors started by the API
+    """
+
+    # Sensor types available in the configuration, loaded on first use so unused drivers are never imported
+    SENSOR_TYPES = {
+        "rainmeter": "sal.rainmeter:RainGauge",
+        "realsense": "sal.realsense:RealSenseSensor",
+        "simulated-raingauge": "sal.simulated:SimulatedRainGauge",
+        "simulated-flow": "sal.simulated:SimulatedFlowSensor",
+        "simulated-pressure": "sal.simulated:SimulatedPressureSensor",
+        "simulated-depth": "sal.simulated:SimulatedDepthCamera",
+    }
+
+    # Initialize the registry
+    def __init__(self):
+        self.sensors = {}
+
+    def __iter__(self):
+        return iter(self.sensors.values())
+
+    def __len__(self):
+        return len(self.sensors)
+
+    def __contains__(self, sensor_id):
+        return sensor_id in self.sensors
+
+    def register(self, sensor):
+        if sensor.sensor_id in self.sensors:
+            raise ValueError("Sensor {} is already registered".format(sensor.sensor_id))
+        self.sensors[sensor.sensor_id] = sensor
+
+    def get(self, sensor_id):
+        return self.sensors.get(sensor_id)
+
+    # Create the registry from a JSON list of {"type": ..., "id": ..., "options": {...}}
+    @classmethod
+    def from_config(cls, config):
+        registry = cls()
+        for entry in json.loads(config or "[]"):
+            module_name, class_name = cls.SENSOR_TYPES[entry["type"]].split(":")
+            sensor_class = getattr(importlib.import_module(module_name), class_name)
+            registry.register(sensor_class(entry["id"], **entry.get("options", {})))
+        return registry
+
+    # Start all sensors, a sensor that fails to start is logged and skipped
+    async def start_all(self):
+        for sensor in self.sensors.values():
+            try:
+                await sensor.start()
+            except Exception as e:
+                logging.error("!! Starting sensor {} failed with error: {} !!".format(sensor.sensor_id, e))
+
+    async def stop_all(self):
+        for sensor in self.sensors.values():
+            try:
+                await sensor.stop()
+            except Exception as e:
+                logging.error("!! Stopping sensor {} failed with error: {} !!".format(sensor.sensor_id, e))
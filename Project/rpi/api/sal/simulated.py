@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, time, threading
+import asyncio
+import numpy as np
+from itertools import repeat
+
+# Import local libraries
+from sal.sal import Sample, Sensor
+from sal.realsense import RealSenseSensor
+
+
+class TrafficModel():
+    """
+        Burst and dropout model of a simulated sensor, the state advances in simulated time
+    """
+
+    # Initialize the traffic model, probabilities are the chance per simulated second that a burst or dropout starts
+    def __init__(self, rng, burst_probability=0.0, burst_factor=10.0, burst_duration=1.0,
+                 dropout_probability=0.0, dropout_duration=1.0):
+        self.rng = rng
+        self.burst_probability = burst_probability
+        self.burst_factor = burst_factor
+        self.burst_duration = burst_duration
+        self.dropout_probability = dropout_probability
+        self.dropout_duration = dropout_duration
+        # Simulated time left in the current burst and dropout
+        self.burst_left = 0.0
+        self.dropout_left = 0.0
+
+    # Advance the model by dt simulated seconds and get the sample rate factor for that step
+    def step(self, dt):
+        if self.dropout_left <= 0 and self.rng.random() < self.dropout_probability * dt:
+            self.dropout_left = self.dropout_duration
+        if self.burst_left <= 0 and self.rng.random() < self.burst_probability * dt:
+            self.burst_left = self.burst_duration
+
+        factor = 1.0
+        if self.dropout_left > 0:
+            factor = 0.0
+        elif self.burst_left > 0:
+            factor = self.burst_factor
+        self.dropout_left = self.dropout_left - dt
+        self.burst_left = self.burst_left - dt
+        return factor
+
+
+class SimulatedSensor(Sensor):
+    """
+        Simulated scalar sensor, a sine signal with gaussian noise at a fixed rate with optional bursts and dropouts
+        With ingest_experiment set the API also stores the samples in that experiment through the ingest path
+    """
+
+    # Initialize the simulated sensor
+    def __init__(self, sensor_id, rate=10.0, mean=0.0, amplitude=0.0, period=60.0, noise=0.0, minimum=None,
+                 speed=1.0, batch_interval_ms=100, batch_size=4096, seed=None,
+                 burst_probability=0.0, burst_factor=10.0, burst_duration=1.0,
+                 dropout_probability=0.0, dropout_duration=1.0, ingest_experiment=None, **kwargs):
+        super().__init__(sensor_id, **kwargs)
+        self.ingest_experiment = ingest_experiment
+        # Nominal sample rate in samples per simulated second
+        self.rate = rate
+        self.mean = mean
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self.minimum = minimum
+        # Simulated seconds per wall clock second, the simulation lags behind when a batch would exceed batch_size
+        self.speed = speed
+        self.batch_interval = batch_interval_ms / 1e3
+        self.batch_size = batch_size
+
+        self.rng = np.random.default_rng(seed)
+        self.traffic = TrafficModel(self.rng, burst_probability, burst_factor, burst_duration,
+                                    dropout_probability, dropout_duration)
+        self.sim_start = None
+        self.sim_time = None
+        self.wall_start = None
+        # Fraction of a sample carried over to the next step so the rate is exact over time
+        self.carry = 0.0
+
+    # Start the simulated clock at the current time
+    async def open(self):
+        self.sim_start = time.time()
+        self.sim_time = self.sim_start
+        self.wall_start = asyncio.get_running_loop().time()
+        logging.info("## Simulated sensor {} running at {} samples/s and {}x speed ##".format(self.sensor_id, self.rate, self.speed))
+
+    # Signal values at the given simulated timestamps
+    def generate(self, timestamps):
+        values = self.mean + self.amplitude * np.sin(2 * np.pi * (timestamps - self.sim_start) / self.period)
+        if self.noise:
+            values = values + self.rng.normal(0.0, self.noise, timestamps.shape)
+        if self.minimum is not None:
+            np.maximum(values, self.minimum, out=values)
+        return values
+
+    # Read the next batch of samples
+    async def read(self):
+        await asyncio.sleep(self.batch_interval)
+
+        # Simulated time the wall clock allows, at most as far as one full batch reaches at the current rate
+        loop = asyncio.get_running_loop()
+        target = self.sim_start + (loop.time() - self.wall_start) * self.speed
+        dt = target - self.sim_time
+        if dt <= 0:
+            return []
+        factor = self.traffic.step(dt)
+        if factor == 0:
+            # Dropout, the sensor is silent for this step
+            self.sim_time = target
+            self.carry = 0.0
+            return []
+        rate = self.rate * factor
+        dt = min(dt, self.batch_size / rate)
+
+        # Evenly spaced samples over the step
+        count = self.carry + rate * dt
+        num_samples = int(count)
+        self.carry = count - num_samples
+        timestamps = self.sim_time + (np.arange(num_samples) + 1) * (dt / max(num_samples, 1))
+        self.sim_time = self.sim_time + dt
+        if num_samples == 0:
+            return []
+
+        values = self.generate(timestamps)
+        return list(map(Sample, timestamps.tolist(), repeat(self.sensor_id), values.tolist()))
+
+
+class SimulatedRainGauge(SimulatedSensor):
+    """
+        Simulated rain gauge, rain intensity in mm/h
+    """
+
+    def __init__(self, sensor_id, rate=100.0, mean=40.0, amplitude=10.0, period=120.0, noise=2.0, minimum=0.0, **kwargs):
+        super().__init__(sensor_id, rate=rate, mean=mean, amplitude=amplitude, period=period, noise=noise, minimum=minimum, **kwargs)
+
+
+class SimulatedFlowSensor(SimulatedSensor):
+    """
+        Simulated nozzle flow sensor, flow in l/min
+    """
+
+    def __init__(self, sensor_id, rate=10.0, mean=6.0, amplitude=0.5, period=30.0, noise=0.1, minimum=0.0, **kwargs):
+        super().__init__(sensor_id, rate=rate, mean=mean, amplitude=amplitude, period=period, noise=noise, minimum=minimum, **kwargs)
+
+
+class SimulatedPressureSensor(SimulatedSensor):
+    """
+        Simulated nozzle pressure sensor, pressure in bar
+    """
+
+    def __init__(self, sensor_id, rate=10.0, mean=1.5, amplitude=0.1, period=30.0, noise=0.02, minimum=0.0, **kwargs):
+        super().__init__(sensor_id, rate=rate, mean=mean, amplitude=amplitude, period=period, noise=noise, minimum=minimum, **kwargs)
+
+
+class SimulatedDepthCamera(RealSenseSensor):
+    """
+        Simulated depth camera, a flat surface with an eroding crater in the middle, supports the baseline and volume captures
+    """
+
+    # Initialize the simulated depth camera
+    def __init__(self, sensor_id, distance_mm=500.0, noise_mm=2.0, erosion_rate_mm=0.5, max_erosion_mm=30.0,
+                 crater_radius=0.25, speed=1.0, seed=None, dropout_probability=0.0, dropout_duration=1.0, **kwargs):
+        super().__init__(sensor_id, **kwargs)
+        self.distance = distance_mm
+        # Crater depth grows by erosion_rate_mm per simulated second up to max_erosion_mm
+        self.erosion_rate = erosion_rate_mm
+        self.max_erosion = max_erosion_mm
+        self.speed = speed
+
+        self.rng = np.random.default_rng(seed)
+        self.traffic = TrafficModel(self.rng, dropout_probability=dropout_probability, dropout_duration=dropout_duration)
+
+        # Crater profile relative to its full depth, radius is a fraction of the frame height
+        y, x = np.mgrid[0:self.height, 0:self.width]
+        radius = np.hypot(x - self.width / 2, y - self.height / 2) / (crater_radius * self.height)
+        self.profile = np.clip(1 - radius ** 2, 0, None).astype(np.float32)
+
+        # A few precomputed noise frames are cycled so noise generation never limits the frame rate
+        self.noise_frames = self.rng.normal(0.0, noise_mm, (8, self.height, self.width)).astype(np.float32)
+        self.scratch = np.empty((self.height, self.width), dtype=np.float32)
+
+    # Start the capture thread, the depth unit is 1 mm like on the D435i
+    async def open(self):
+        self.depth_scale = 0.001
+        self.is_capturing = True
+        self.thread = threading.Thread(target=self.capture, name="sensor-{}".format(self.sensor_id), daemon=True)
+        self.thread.start()
+
+    async def close(self):
+        self.is_capturing = False
+        if self.thread is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+            self.thread = None
+
+    # Synthesize frames at fps times the simulation speed
+    def capture(self):
+        frame_interval = 1 / self.fps
+        sim_time = 0.0
+        next_frame = time.monotonic()
+        while self.is_capturing:
+            next_frame = next_frame + frame_interval / self.speed
+            time.sleep(max(next_frame - time.monotonic(), 0))
+            sim_time = sim_time + frame_interval
+            if self.traffic.step(frame_interval) == 0:
+                # Dropped frame
+                continue
+
+            # Depth of the surface, eroded in the crater
+            erosion = min(sim_time * self.erosion_rate, self.max_erosion)
+            np.multiply(self.profile, erosion, out=self.scratch)
+            self.scratch += self.distance
+            self.scratch += self.noise_frames[self.num_frames % len(self.noise_frames)]
+            with self.lock:
+                index = self.num_frames % self.stack_size
+                np.clip(self.scratch, 0, 65535, out=self.scratch)
+                self.frames[index] = self.scratch
+                self.timestamps[index] = time.time()
+                self.num_frames = self.num_frames + 1
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, os, json
+import asyncio
+import aiohttp
+from aiohttp import web
+
+# Request headers that belong to one connection and are not forwarded to another worker
+HOP_HEADERS = ("host", "connection", "keep-alive", "content-length", "transfer-encoding", "upgrade")
+
+
+class WorkerPeers():
+    """
+        Links between the worker processes of a pre-fork server over per-worker Unix sockets
+        Workers relay live broadcasts to each other, forward sensor requests to the worker owning the sensors
+        and collect each other's metrics, the routes under /internal are only served on the Unix sockets
+    """
+
+    # Initialize the links of worker slot to the other num_workers - 1 workers, prefix is the URL prefix of the API
+    def __init__(self, slot, num_workers, socket_dir, prefix, broadcaster, owner_slot=0, timeout=120.0):
+        self.slot = slot
+        self.num_workers = num_workers
+        self.socket_dir = socket_dir
+        self.prefix = prefix
+        self.broadcaster = broadcaster
+        self.owner_slot = owner_slot
+        self.timeout = timeout
+        self.sessions = {}
+        # Relay WebSocket per peer, and the topics with local subscribers that are subscribed on every peer
+        self.links = {}
+        self.link_tasks = []
+        self.topics = set()
+
+    # Unix socket path of a worker
+    def path(self, slot):
+        return os.path.join(self.socket_dir, "worker-{}.sock".format(slot))
+
+    @property
+    def peer_slots(self):
+        return [slot for slot in range(self.num_workers) if slot != self.slot]
+
+    # Check if this worker runs the sensors
+    @property
+    def is_owner(self):
+        return self.slot == self.owner_slot
+
+    # Check if a request came from another worker, the internal routes are not served on the public socket
+    @staticmethod
+    def is_internal(request):
+        return isinstance(request.transport.get_extra_info("sockname"), str)
+
+    def url(self, path):
+        return "http://worker{}".format(path)
+
+    # Open the sessions and relay links to the peers
+    async def start(self, app):
+        for slot in self.peer_slots:
+            self.sessions[slot] = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=self.path(slot)))
+            self.link_tasks.append(asyncio.create_task(self.link(slot)))
+        self.broadcaster.on_topics_changed = self.sync_topics
+
+    async def close(self, app):
+        for task in self.link_tasks:
+            task.cancel()
+        await asyncio.gather(*self.link_tasks, return_exceptions=True)
+        for session in self.sessions.values():
+            await session.close()
+
+    # Relay link to one peer, reconnected while the peer restarts
+    # The topics with local subscribers are subscribed on the peer and its messages are delivered to the local clients
+    async def link(self, slot):
+        while True:
+            try:
+                async with self.sessions[slot].ws_connect(self.url(self.prefix + "/internal/ws"), heartbeat=30) as ws:
+                    logging.debug("## Relay link from worker {} to worker {} connected ##".format(self.slot, slot))
+                    self.links[slot] = ws
+                    if self.topics:
+                        await ws.send_str(json.dumps({"subscribe": sorted(self.topics)}))
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            self.broadcaster.deliver(json.loads(message.data)["topic"], message.data, peers=False)
+            except (aiohttp.ClientError, OSError, ValueError, KeyError) as e:
+                logging.debug("## Relay link from worker {} to worker {} failed: {} ##".format(self.slot, slot, e))
+            finally:
+                self.links.pop(slot, None)
+            await asyncio.sleep(1)
+
+    # Subscribe the peers to the topics of the local clients, called by the broadcaster when they change
+    def sync_topics(self):
+        topics = self.broadcaster.local_topics()
+        subscribe, unsubscribe = topics - self.topics, self.topics - topics
+        self.topics = topics
+        if subscribe or unsubscribe:
+            message = json.dumps({"subscribe": sorted(subscribe), "unsubscribe": sorted(unsubscribe)})
+            for ws in list(self.links.values()):
+                asyncio.ensure_future(ws.send_str(message))
+
+    # Forward a request to another worker and return its response
+    async def forward(self, request, slot):
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_HEADERS}
+        try:
+            async with self.sessions[slot].request(request.method, self.url(request.path_qs),
+                                                   headers=headers, data=await request.read(),
+                                                   timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                body = await response.read()
+                return web.Response(status=response.status, body=body,
+                                    headers={"Content-Type": response.headers.get("Content-Type", "application/octet-stream")})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error("!! Forwarding {} to worker {} failed with error: {} !!".format(request.path, slot, e))
+            raise web.HTTPServiceUnavailable(text="!! Sensor worker not available !!\n")
+
+    # Forward a WebSocket request to another worker, text messages are passed through in both directions
+    async def forward_ws(self, request, slot):
+        try:
+            peer_ws = await self.sessions[slot].ws_connect(self.url(request.path_qs), heartbeat=30)
+        except aiohttp.WSServerHandshakeError as e:
+            # Requests rejected by the other worker get its status, the handshake error does not carry the response text
+            return web.Response(status=e.status, text="!! Request rejected by worker {} with status {} !!\n".format(slot, e.status))
+        except aiohttp.ClientError as e:
+            logging.error("!! Forwarding {} to worker {} failed with error: {} !!".format(request.path, slot, e))
+            raise web.HTTPServiceUnavailable(text="!! Sensor worker not available !!\n")
+
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        async def to_peer():
+            async for message in ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await peer_ws.send_str(message.data)
+            await peer_ws.close()
+        task = asyncio.create_task(to_peer())
+        try:
+            async for message in peer_ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await ws.send_str(message.data)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await peer_ws.close()
+            await ws.close()
+        return ws
+
+    # Forward a sensor request to the worker owning the sensors, None if this worker owns them
+    async def forward_to_owner(self, request):
+        if self.is_owner:
+            return None
+        return await self.forward(request, self.owner_slot)
+
+    # JSON responses of a GET path from all peers, peers that do not answer in time are left out
+    async def gather(self, path, timeout=2.0):
+        async def get(slot):
+            async with self.sessions[slot].get(self.url(self.prefix + path), timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                return await response.json()
+        results = await asyncio.gather(*(get(slot) for slot in self.peer_slots), return_exceptions=True)
+        return [result for result in results if not isinstance(result, BaseException)]
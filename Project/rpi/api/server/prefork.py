@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# Import general libraries
+import logging, os, signal, socket, select, time
+
+
+class PreforkServer():
+    """
+        Pre-fork master, N worker processes accept connections on one inherited listening socket
+        Every worker runs its own event loop and DB client, SIGHUP replaces the workers one by one
+    """
+
+    # Initialize the master, worker_main(slot, sock, ready_fd) runs the worker and writes to ready_fd once serving
+    def __init__(self, worker_main, num_workers, host, port, exclusive_slots=(), ready_timeout=60.0, stop_timeout=70.0):
+        self.worker_main = worker_main
+        self.num_workers = num_workers
+        self.host = host
+        self.port = port
+        # Slots owning exclusive resources (sensors) are stopped before their replacement starts
+        self.exclusive_slots = set(exclusive_slots)
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.sock = None
+        # Slot to worker pid, and pids that are being stopped on purpose and must not be respawned
+        self.workers = {}
+        self.retired = set()
+        self.stopping = False
+        self.restarting = False
+
+    # Create the listening socket shared by all workers
+    def bind(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(1024)
+        self.sock.set_inheritable(True)
+
+    # Fork a worker for a slot and wait until it serves requests, a worker that does not become ready is stopped
+    # and the slot is left to the caller or to the respawn in run()
+    def spawn(self, slot):
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Worker, the master signal handlers do not apply here
+            os.close(ready_read)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                self.worker_main(slot, self.sock, ready_write)
+            except BaseException:
+                logging.exception("!! Worker {} failed !!".format(slot))
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        os.close(ready_write)
+        self.workers[slot] = pid
+        logging.info("## Started worker {} with pid {} ##".format(slot, pid))
+
+        # The worker writes to the pipe after startup, a closed pipe means it exited
+        try:
+            readable, _, _ = select.select([ready_read], [], [], self.ready_timeout)
+            ready = bool(readable) and os.read(ready_read, 1) == b"1"
+        finally:
+            os.close(ready_read)
+        if not ready:
+            logging.error("!! Worker {} with pid {} did not become ready, stopping it !!".format(slot, pid))
+            # Stop it before it accepts connections on the shared socket without being tracked
+            del self.workers[slot]
+            self.terminate(pid)
+        return ready
+
+    # Send SIGTERM to a worker and wait for its graceful shutdown
+    def terminate(self, pid):
+        self.retired.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.retired.discard(pid)
+            return
+        self.wait(pid)
+
+    # Wait for a stopping worker, SIGKILL after stop_timeout
+    def wait(self, pid):
+        deadline = time.monotonic() + self.stop_timeout
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                self.retired.discard(pid)
+                return
+            time.sleep(0.1)
+        logging.error("!! Worker with pid {} did not stop, killing it !!".format(pid))
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        self.retired.discard(pid)
+
+    # Replace the workers one by one so the others keep serving
+    def rolling_restart(self):
+        logging.info("## Rolling restart of {} workers... ##".format(len(self.workers)))
+        for slot in sorted(self.workers):
+            old_pid = self.workers[slot]
+            if slot in self.exclusive_slots:
+                self.terminate(old_pid)
+                self.spawn(slot)
+            elif self.spawn(slot):
+                self.terminate(old_pid)
+            else:
+                # Keep the old worker when its replacement fails
+                self.workers[slot] = old_pid
+        logging.info("## Rolling restart complete ##")
+
+    # Start workers for the slots without one, e.g. after a replacement did not become ready
+    def respawn_missing(self):
+        for slot in range(self.num_workers):
+            if slot not in self.workers and not self.stopping:
+                self.spawn(slot)
+
+    # Reap exited workers and respawn the ones that exited unexpectedly
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.retired:
+                self.retired.discard(pid)
+                continue
+            for slot, worker_pid in list(self.workers.items()):
+                if worker_pid == pid and not self.stopping:
+                    logging.error("!! Worker {} with pid {} exited with status {}, restarting it !!".format(slot, pid, status))
+                    time.sleep(1)
+                    self.spawn(slot)
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_restart(self, signum, frame):
+        self.restarting = True
+
+    # Run the master until SIGTERM or SIGINT, SIGHUP triggers a rolling restart
+    def run(self):
+        self.bind()
+        logging.info("## Master {} serving on http://{}:{} with {} workers ##".format(os.getpid(), self.host, self.port, self.num_workers))
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+
+        for slot in range(self.num_workers):
+            self.spawn(slot)
+
+        while not self.stopping:
+            if self.restarting:
+                self.restarting = False
+                self.rolling_restart()
+            self.reap()
+            self.respawn_missing()
+            time.sleep(0.5)
+
+        logging.info("## Stopping {} workers... ##".format(len(self.workers)))
+        for pid in list(self.workers.values()):
+            self.retired.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.workers.values()):
+            try:
+                self.wait(pid)
+            except ChildProcessError:
+                pass
+        self.sock.close()
@@ -0,0 +1,101 @@
+import threading
+import numpy as np
+import pyrealsense2 as rs
+
+
+class ImuMonitor:
+    """
+    Class for capturing the D435i accelerometer and gyro into ring buffers for vibration detection
+    Methods:
+        __init__(): Initialize the IMU monitor object
+        start(): Start the IMU streams and the capture thread
+        stop(): Stop the capture thread and the IMU streams
+        capture(): Capture loop running on its own thread
+        get_window(): Get the samples of one stream inside a time window
+        get_vibration_level(): Get the accelerometer and gyro vibration levels around a timestamp
+        is_stable(): Check if the vibration around a timestamp is below the thresholds
+
+    Attributes:
+        pipeline: RealSense pipeline object for the IMU streams
+        config: RealSense config object for the IMU streams
+        capacity: Number of samples kept for each stream
+        timestamps: Ring buffer of sample timestamps in milliseconds for each stream
+        magnitudes: Ring buffer of sample magnitudes for each stream
+        num_samples: Number of samples written for each stream
+        lock: Lock protecting the ring buffers
+        is_running: Boolean for capture thread status
+        thread: Capture thread
+    """
+
+    def __init__(self, device_serial=None, capacity=4096, accel_rate=250, gyro_rate=200):
+        # Create a separate pipeline so the IMU runs at its own rate, independent of the depth frames
+        self.pipeline = rs.pipeline()
+        self.config = rs.config()
+        if device_serial is not None:
+            self.config.enable_device(device_serial)
+        self.config.enable_stream(rs.stream.accel, rs.format.motion_xyz32f, accel_rate)
+        self.config.enable_stream(rs.stream.gyro, rs.format.motion_xyz32f, gyro_rate)
+
+        # Preallocated ring buffers, accelerometer in m/s^2 and gyro in rad/s
+        self.capacity = capacity
+        self.timestamps = {stream: np.full(capacity, -np.inf) for stream in ("accel", "gyro")}
+        self.magnitudes = {stream: np.zeros(capacity) for stream in ("accel", "gyro")}
+        self.num_samples = {"accel": 0, "gyro": 0}
+        self.lock = threading.Lock()
+
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.pipeline.start(self.config)
+        self.is_running = True
+        self.thread = threading.Thread(target=self.capture, name="imu-capture", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.pipeline.stop()
+
+    def capture(self):
+        while self.is_running:
+            try:
+                frames = self.pipeline.wait_for_frames(1000)
+            except RuntimeError:
+                # No IMU samples within the timeout
+                continue
+
+            for frame in frames:
+                motion_frame = frame.as_motion_frame()
+                stream = "accel" if motion_frame.get_profile().stream_type() == rs.stream.accel else "gyro"
+                data = motion_frame.get_motion_data()
+                with self.lock:
+                    index = self.num_samples[stream] % self.capacity
+                    self.timestamps[stream][index] = motion_frame.get_timestamp()
+                    self.magnitudes[stream][index] = np.sqrt(data.x * data.x + data.y * data.y + data.z * data.z)
+                    self.num_samples[stream] = self.num_samples[stream] + 1
+
+    def get_window(self, stream, start, stop):
+        with self.lock:
+            inside = (self.timestamps[stream] >= start) & (self.timestamps[stream] <= stop)
+            return self.magnitudes[stream][inside]
+
+    def get_vibration_level(self, timestamp, window_ms=33.0):
+        # Samples around the depth frame timestamp, both use the camera global time domain
+        start, stop = timestamp - window_ms / 2, timestamp + window_ms / 2
+        accel = self.get_window("accel", start, stop)
+        gyro = self.get_window("gyro", start, stop)
+        # Accelerometer vibration is the deviation around gravity, gyro vibration is the RMS rotation rate
+        accel_level = np.std(accel) if accel.size > 1 else None
+        gyro_level = np.sqrt(np.mean(gyro ** 2)) if gyro.size > 0 else None
+        return accel_level, gyro_level
+
+    def is_stable(self, timestamp, max_accel_level, max_gyro_level, window_ms=33.0):
+        # Frames without IMU samples in the window are accepted
+        accel_level, gyro_level = self.get_vibration_level(timestamp, window_ms)
+        if accel_level is not None and accel_level > max_accel_level:
+            return False
+        if gyro_level is not None and gyro_level > max_gyro_level:
+            return False
+        return True
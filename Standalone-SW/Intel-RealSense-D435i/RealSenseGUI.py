@@ -1,8 +1,72 @@
-import os, cv2, datetime
+import os, cv2, datetime, time, argparse
+from collections import deque
 import numpy as np
 import pyrealsense2 as rs
 import tkinter as tk
 from PIL import Image, ImageTk, ImageDraw
+from StreamServer import StreamServer
+from ImuMonitor import ImuMonitor
+
+
+class DepthColorizer:
+    """
+    Class for mapping z16 depth frames to grayscale and color images through cached lookup tables
+    Methods:
+        __init__(): Initialize the colorizer object
+        update_range(): Update the display range from a depth frame and rebuild the lookup tables if it changed
+        build_luts(): Build the grayscale and color lookup tables for a display range
+        normalize(): Map a depth frame to a grayscale image
+        colorize(): Map a depth frame to a color image
+
+    Attributes:
+        colormap: OpenCV colormap used for the color lookup tables
+        range_step: Step in depth units the display range is rounded to
+        sample_stride: Stride of the pixels sampled for the display range
+        fixed_range: Fixed display range in depth units, None for the automatic range
+        display_range: Display range of the current lookup tables
+        gray_lut: Lookup table from depth values to grayscale
+        rgb_lut: Lookup table from depth values to RGB colors
+        bgr_lut: Lookup table from depth values to BGR colors
+    """
+
+    def __init__(self, colormap=cv2.COLORMAP_JET, range_step=16, sample_stride=8):
+        self.colormap = colormap
+        self.range_step = range_step
+        self.sample_stride = sample_stride
+        self.fixed_range = None
+        self.display_range = None
+        self.gray_lut = None
+        self.rgb_lut = None
+        self.bgr_lut = None
+
+    def update_range(self, depth_image):
+        if self.fixed_range is not None:
+            low, high = self.fixed_range
+        else:
+            # Interquartile range of a sparse sample of the frame
+            q1, q3 = np.percentile(depth_image[::self.sample_stride, ::self.sample_stride], [25, 75])
+            # Round the range so small fluctuations do not rebuild the lookup tables on every frame
+            low = int(q1) // self.range_step * self.range_step
+            high = max(-(-int(q3) // self.range_step) * self.range_step, low + self.range_step)
+
+        if (low, high) != self.display_range:
+            self.build_luts(low, high)
+
+    def build_luts(self, low, high):
+        # Normalize every possible z16 value once
+        depth_values = np.arange(65536, dtype=np.float32)
+        self.gray_lut = (np.clip((depth_values - low) / (high - low), 0, 1) * 255).astype(np.uint8)
+        # Color the normalized values, invalid pixels (zero depth) stay black
+        self.bgr_lut = cv2.applyColorMap(self.gray_lut.reshape(-1, 1), self.colormap).reshape(-1, 3)
+        self.bgr_lut[0] = 0
+        self.rgb_lut = np.ascontiguousarray(self.bgr_lut[:, ::-1])
+        self.display_range = (low, high)
+
+    def normalize(self, depth_image):
+        return np.take(self.gray_lut, depth_image)
+
+    def colorize(self, depth_image, bgr=False):
+        return np.take(self.bgr_lut if bgr else self.rgb_lut, depth_image, axis=0)
 
 
 class RealSenseCamera:
@@ -15,15 +79,41 @@ class RealSenseCamera:
         get_rgb_frame(): Get the current RGB frame
         get_depth_frame(): Get the current depth frame
         get_real_depth_frame(): Get the current depth frame in real units
+        is_frame_stable(): Check if the IMU vibration during a depth frame is below the thresholds
+        get_stable_depth_frame(): Get the next depth frame that is not corrupted by vibration
         normalize_depth_frame(): Normalize the depth frame
+        colorize_depth_frame(): Colorize the depth frame
         calculate_average_depth_frame(): Calculate the average depth frame
+        median_depth_stack(): Calculate the per-pixel median of the depth stack ignoring invalid pixels
+        trimmed_mean_depth_stack(): Calculate the per-pixel trimmed mean of the depth stack ignoring invalid pixels
         select_roi(): Select ROI for depth image
         reset_roi(): Reset ROI for depth image
+        select_roi_regions(): Select polygon regions for depth image
+        rasterize_roi_regions(): Rasterize the polygon regions into masks and flat index arrays
+        compute_region_sums(): Calculate the sum and valid pixel count of every region with one bincount pass
+        compute_region_volume_change(): Calculate the volume change of every region against the recording baseline
+        compute_tile_volume_change(): Calculate the volume change of every tile in the ROI
+        render_erosion_heat_map(): Render the tile volume changes as a heat map over the depth image
+        save_tile_time_series(): Save the recorded tile volume changes to a file
+        update_noise_statistics(): Update the online per-pixel depth noise statistics
+        reset_noise_statistics(): Reset the online per-pixel depth noise statistics
+        get_noise_sigma(): Get the per-pixel depth noise standard deviation in meters
+        create_video_writers(): Create the RGB and depth video writers
         start_recording(): Start recording RGB and depth frames
         stop_recording(): Stop recording RGB and depth frames
+        prepare_threshold_sweep(): Sort the last difference frame for the interactive threshold sweep
+        update_threshold_sweep(): Update the changed pixels and masked volume for the current threshold
+        set_volume_change_threshold(): Set the volume change threshold and update the threshold sweep
+        set_auto_record_enabled(): Enable or disable event-triggered recording
+        compute_change_metric(): Calculate the downsampled depth change against a reference depth frame
+        update_change_reference(): Update the rolling reference depth frame of an event-triggered recording
+        update_auto_record(): Start, continue or stop event-triggered recording for the current frame
+        stop_auto_record_segment(): Stop the current event-triggered recording segment
         update(): Update the Tkinter window
         display_frames_tkinter(): Display the frames in the Tkinter window
+        publish_stream_frames(): Publish the current frames to the stream server
         run(): Run the Tkinter window
+        run_headless(): Run the capture loop without the Tkinter window for streaming only
 
     Attributes:
         pipeline: RealSense pipeline object
@@ -31,14 +121,62 @@ class RealSenseCamera:
         canvas: Tkinter canvas object
         is_running: Boolean for camera stream status
         roi_points: ROI points for depth image
+        roi_regions: Polygon regions for depth image in frame coordinates
+        region_indices: Flat indices of the pixels of all regions inside the ROI
+        region_frame_indices: Flat indices of the pixels of all regions inside the full frame
+        region_labels: Region number of every entry in the region index arrays
+        region_union_mask: Mask of the pixels that belong to any region inside the ROI
+        region_volume_change: Volume change of every region
         recording: Boolean for recording status
         recording_counter: Counter for number of measurements recorded
+        auto_record_enabled: Boolean for event-triggered recording status
+        auto_record_threshold: Mean depth change in meters that starts an event-triggered recording
+        auto_record_quiet_period: Seconds without change after which an event-triggered recording stops
+        auto_record_stride: Downsampling stride of the change metric
+        auto_record_baseline: Depth frame the start of an event-triggered recording is detected against
+        auto_record_reference: Rolling average of the recent depth frames the end of a recording is detected against
+        auto_record_reference_weight: Weight of the current frame in the rolling reference
+        preroll_buffer: Ring buffer of the last frames written at the start of an event-triggered recording
+        auto_recording: Boolean for event-triggered recording segment status
         frame_averaging_enabled: Boolean for frame averaging status
         num_frames: Number of frames to average
+        max_num_frames: Maximum number of frames to average (size of the depth stack)
+        baseline_mode: Mode for the average depth frame ("mean", "median" or "trimmed mean")
+        trim_fraction: Fraction of valid samples trimmed from each end for the trimmed mean
+        depth_stack: Preallocated stack of the last depth frames used for averaging
+        valid_count_map: Number of valid (non-zero) samples of every pixel in the depth stack
         volume_change: Volume change between the first and last depth frames
         volume_change_threshold: Threshold for volume change
+        volume_change_confidence: Half-width of the 95% confidence interval of the volume change
+        sweep_order: Flat indices of the last real difference frame (inside the regions if selected) sorted by value
+        sweep_sorted_diff: Sorted values of the last real difference frame
+        sweep_cumsum: Cumulative sum of the sorted values of the last real difference frame
+        sweep_base_frame: RGB normalized difference frame used for the threshold sweep overlay
+        sweep_auto_mask: Mask of the pixels of the last measurement with a noise-based threshold, None without one
+        sweep_auto_threshold: Threshold map of the last measurement with a noise-based threshold
+        sweep_fixed_pixels: Flat indices of the changed pixels with a noise-based threshold, they do not depend on the slider
+        sweep_fixed_sum: Sum of the difference values of the changed pixels with a noise-based threshold
+        auto_threshold_enabled: Boolean for the noise-based volume change threshold status
+        noise_threshold_sigmas: Number of noise standard deviations used for the noise-based threshold
+        noise_count: Number of valid samples of every pixel in the noise statistics
+        noise_mean: Running mean of every pixel in the noise statistics
+        noise_m2: Running sum of squared deviations of every pixel in the noise statistics
+        depth_scale: Depth units of the z16 depth frames in meters
+        erosion_map_enabled: Boolean for tiled erosion map status
+        tile_rows: Number of tile rows in the erosion map grid
+        tile_cols: Number of tile columns in the erosion map grid
+        tile_volume_change: Volume change of every tile between the baseline and the current depth frame
+        tile_time_series: Timestamps and tile volume changes recorded during the measurement
+        erosion_heat_map: RGB heat map of the tile volume changes for display
         cp_width: Width of the control panel
         cp_height: Height of the control panel
+        imu_monitor: IMU monitor for vibration detection, None when the camera has no IMU
+        vibration_rejection_enabled: Boolean for vibrating frame rejection status
+        max_accel_vibration: Maximum accelerometer vibration level (standard deviation in m/s^2) of accepted frames
+        max_gyro_vibration: Maximum gyro vibration level (RMS in rad/s) of accepted frames
+        rejected_frames: Number of depth frames rejected because of vibration
+        depth_colorizer: Lookup table based depth colorizer
+        stream_server: Stream server for browser clients, None when streaming is disabled
     """
 
     # Initialize the camera object
@@ -58,6 +196,23 @@ class RealSenseCamera:
         depth_sensor.set_option(rs.option.gain, 16)  # Adjust gain
         depth_sensor.set_option(rs.option.laser_power, 250)  # Adjust laser power
 
+        # Depth units used to convert z16 depth frames to meters
+        self.depth_scale = depth_sensor.get_depth_scale()
+
+        # Capture the IMU streams of the same device on their own thread
+        try:
+            self.imu_monitor = ImuMonitor(profile.get_device().get_info(rs.camera_info.serial_number))
+            self.imu_monitor.start()
+        except RuntimeError as e:
+            print("IMU not available, vibrating frames will not be rejected: ", e)
+            self.imu_monitor = None
+
+        # Attributes for vibration-aware frame rejection
+        self.vibration_rejection_enabled = self.imu_monitor is not None
+        self.max_accel_vibration = 0.5
+        self.max_gyro_vibration = 0.1
+        self.rejected_frames = 0
+
         # General attributes
         self.rgb_frames = []
         self.canvas = None
@@ -66,22 +221,89 @@ class RealSenseCamera:
         # Attributes for ROI selection
         self.roi_points = None 
 
+        # Attributes for polygon and multi-region ROI
+        self.roi_regions = []
+        self.region_indices = None
+        self.region_frame_indices = None
+        self.region_labels = None
+        self.region_union_mask = None
+        self.region_volume_change = None
+
         # Attributes for recording
         self.recording = False
         self.recording_conuter = 1
 
+        # Attributes for event-triggered recording
+        self.auto_record_enabled = False
+        self.auto_record_threshold = 0.005
+        self.auto_record_quiet_period = 5.0
+        self.auto_record_stride = 8
+        self.auto_record_baseline = None
+        self.auto_record_reference = None
+        self.auto_record_reference_weight = 0.2
+        self.preroll_buffer = deque(maxlen=30)
+        self.auto_recording = False
+        self.auto_record_last_change = None
+        self.auto_record_segment = 1
+
         # Attributes for frame averaging
         self.frame_averaging_enabled = True
         self.num_frames = 10
+        self.max_num_frames = 100
+
+        # Attributes for robust baseline calculation
+        self.baseline_mode = "mean"
+        self.trim_fraction = 0.1
+        self.depth_stack = np.zeros((self.max_num_frames, 480, 640), dtype=np.uint16)
+        self.valid_count_map = np.zeros((480, 640), dtype=np.uint8)
 
         # Volume calculation
         self.volume_change = None
         self.volume_change_threshold = 0.7
+        self.volume_change_confidence = None
+
+        # Attributes for the threshold sweep of the last measurement
+        self.sweep_order = None
+        self.sweep_sorted_diff = None
+        self.sweep_cumsum = None
+        self.sweep_base_frame = None
+        self.sweep_window = None
+        self.sweep_auto_mask = None
+        self.sweep_auto_threshold = None
+        self.sweep_fixed_pixels = None
+        self.sweep_fixed_sum = 0.0
+
+        # Attributes for online noise statistics (Welford) collected while idle
+        self.auto_threshold_enabled = True
+        self.noise_threshold_sigmas = 3.0
+        self.noise_count = np.zeros((480, 640), dtype=np.uint32)
+        self.noise_mean = np.zeros((480, 640), dtype=np.float32)
+        self.noise_m2 = np.zeros((480, 640), dtype=np.float32)
+        self.noise_delta = np.zeros((480, 640), dtype=np.float32)
+        self.noise_scratch = np.zeros((480, 640), dtype=np.float32)
+        self.noise_valid = np.zeros((480, 640), dtype=bool)
+
+        # Attributes for the tiled erosion map
+        self.erosion_map_enabled = False
+        self.tile_rows = 4
+        self.tile_cols = 4
+        self.tile_grid = (self.tile_rows, self.tile_cols)
+        self.baseline_depth_array = None
+        self.tile_volume_change = None
+        self.tile_time_series = []
+        self.erosion_heat_map = None
 
         # Attributes for tkinter display
         self.cp_width = 70
         self.cp_height = 100
 
+        # Attributes for depth display
+        self.depth_colorizer = DepthColorizer()
+        self.colorized_depth_frame = None
+
+        # Attributes for browser streaming
+        self.stream_server = None
+
 
     ##########################################################################################################################
     # Stream management functions, use this to start and stop the camera streams
@@ -89,15 +311,22 @@ class RealSenseCamera:
         print("Starting streams")
         print("Frame averaging enabled: ", self.frame_averaging_enabled)
         print("Number of frames: ", self.num_frames)
+        print("Baseline mode: ", self.baseline_mode)
+        print("Vibration rejection enabled: ", self.vibration_rejection_enabled)
         print("ROI points: ", self.roi_points)
         print("Volume change threshold: {:.2f}".format(self.volume_change_threshold))
+        print("Automatic noise threshold: ", self.auto_threshold_enabled)
         print("Recording: ", self.recording)
+        print("Auto recording enabled: ", self.auto_record_enabled)
         self.is_running = True
         self.update()
 
     def stop_streams(self):
         print("Stopping streams")
         self.is_running = False
+        # Close the event-triggered recording segment
+        if self.auto_recording:
+            self.stop_auto_record_segment()
 
 
     ##########################################################################################################################
@@ -114,40 +343,102 @@ class RealSenseCamera:
         return depth_frame
 
     def get_real_depth_frame(self):
-        frames = self.pipeline.wait_for_frames()
-        depth_frame = frames.get_depth_frame()
+        depth_frame = self.get_stable_depth_frame()
         depth_image = np.zeros((480, 640), dtype=np.float32)
         for i in range(480):
             for j in range(640):
                 depth_image[i, j] = depth_frame.get_distance(j, i)
         return depth_image
 
+    def is_frame_stable(self, depth_frame):
+        if not self.vibration_rejection_enabled or self.imu_monitor is None:
+            return True
+        # Join the depth frame with the IMU samples by timestamp
+        return self.imu_monitor.is_stable(depth_frame.get_timestamp(), self.max_accel_vibration, self.max_gyro_vibration)
+
+    def get_stable_depth_frame(self, max_attempts=30):
+        # Skip frames captured during vibration, give up after max_attempts frames so the GUI does not hang
+        for i in range(max_attempts):
+            depth_frame = self.get_depth_frame()
+            if self.is_frame_stable(depth_frame):
+                return depth_frame
+            self.rejected_frames = self.rejected_frames + 1
+        print("No stable depth frame in {} frames, using the last frame".format(max_attempts))
+        return depth_frame
+
 
     ##########################################################################################################################
     # Frame processing functions
     def normalize_depth_frame(self, depth_frame):
+        # The lookup tables are only rebuilt when the display range changes
+        depth_image = np.asanyarray(depth_frame.get_data())
+        self.depth_colorizer.update_range(depth_image)
+        return self.depth_colorizer.normalize(depth_image)
+
+    def colorize_depth_frame(self, depth_frame, bgr=False):
+        # Uses the display range of the last normalized depth frame
         depth_image = np.asanyarray(depth_frame.get_data())
-        q1 = np.percentile(depth_image, 25)
-        q3 = np.percentile(depth_image, 75)
-        normalized_depth = np.clip((depth_image - q1) / (q3 - q1), 0, 1) * 255
-        return normalized_depth.astype(np.uint8)
+        return self.depth_colorizer.colorize(depth_image, bgr)
 
     def calculate_average_depth_frame(self):
-        # Create the average depth frame
-        average_depth_frame = np.asanyarray(self.get_depth_frame().get_data())
-        for i in range(self.num_frames - 1):
-            average_depth_frame = average_depth_frame + np.asanyarray(self.get_depth_frame().get_data())
+        # Fill the preallocated depth stack with the last N depth frames
+        num_frames = min(self.num_frames, self.max_num_frames)
+        depth_stack = self.depth_stack[:num_frames]
+        for i in range(num_frames):
+            depth_stack[i] = np.asanyarray(self.get_stable_depth_frame().get_data())
+
+        # Count the valid (non-zero) samples of every pixel
+        valid_count = np.count_nonzero(depth_stack, axis=0)
+        self.valid_count_map[:] = valid_count
+
+        # Calculate the robust average depth frame if selected
+        if self.baseline_mode == "median":
+            return self.median_depth_stack(depth_stack, valid_count)
+        elif self.baseline_mode == "trimmed mean":
+            return self.trimmed_mean_depth_stack(depth_stack, valid_count)
+
         # Normalize the average depth frame
-        average_depth_frame = average_depth_frame / self.num_frames
+        average_depth_frame = depth_stack.sum(axis=0, dtype=np.float64) / num_frames
         return average_depth_frame
 
+    def median_depth_stack(self, depth_stack, valid_count):
+        # Sort the stack in place, invalid pixels (zeros) end up at the start of every column
+        num_frames = depth_stack.shape[0]
+        depth_stack.sort(axis=0)
+        # Indices of the two middle valid samples of every pixel
+        first_valid = num_frames - valid_count
+        lower = np.minimum(first_valid + (valid_count - 1) // 2, num_frames - 1)
+        upper = np.minimum(first_valid + valid_count // 2, num_frames - 1)
+        lower_values = np.take_along_axis(depth_stack, lower[np.newaxis], axis=0)[0]
+        upper_values = np.take_along_axis(depth_stack, upper[np.newaxis], axis=0)[0]
+        # Average the middle samples, pixels without valid samples stay invalid
+        median_depth_frame = (lower_values.astype(np.float32) + upper_values) / 2
+        median_depth_frame[valid_count == 0] = 0
+        return median_depth_frame
+
+    def trimmed_mean_depth_stack(self, depth_stack, valid_count):
+        # Sort the stack in place, invalid pixels (zeros) end up at the start of every column
+        num_frames = depth_stack.shape[0]
+        depth_stack.sort(axis=0)
+        # Range of valid samples that are kept after trimming both ends
+        num_trimmed = (valid_count * self.trim_fraction).astype(np.int64)
+        start = num_frames - valid_count + num_trimmed
+        stop = num_frames - num_trimmed
+        # Sum the kept samples one frame at a time to keep the memory bounded
+        depth_sum = np.zeros(depth_stack.shape[1:], dtype=np.float32)
+        for i in range(num_frames):
+            np.add(depth_sum, depth_stack[i], out=depth_sum, where=(start <= i) & (i < stop))
+        # Pixels without valid samples stay invalid
+        trimmed_mean_depth_frame = np.divide(depth_sum, stop - start, out=np.zeros_like(depth_sum), where=valid_count > 0)
+        return trimmed_mean_depth_frame
+
     ##########################################################################################################################
     # ROI selection functions
     def select_roi(self):
-        # Get the current depth frame and normalize it
-        depth_frame = self.normalize_depth_frame(self.get_depth_frame())
-        # Convert depth frame to RGB for display
-        depth_frame = cv2.cvtColor(depth_frame, cv2.COLOR_GRAY2RGB)
+        # Get the current depth frame and colorize it for display
+        depth_frame = self.get_depth_frame()
+        self.normalize_depth_frame(depth_frame)
+        depth_frame = self.colorize_depth_frame(depth_frame, bgr=True)
         # Open new window for ROI selection
         cv2.namedWindow("Select ROI")
         cv2.imshow("Select ROI", depth_frame)
@@ -155,23 +446,191 @@ class RealSenseCamera:
         roi_points = cv2.selectROI("Select ROI", depth_frame, fromCenter=False, showCrosshair=True)
         # Close window when ROI is selected
         cv2.destroyWindow("Select ROI")
-        # Save ROI points
+        # Save ROI points, a rectangle replaces the polygon regions
         self.roi_points = roi_points
         self.roi_flag = True
+        self.roi_regions = []
+        self.rasterize_roi_regions()
 
     def reset_roi(self):
         self.roi_points = None
+        self.roi_regions = []
+        self.rasterize_roi_regions()
+
+    def select_roi_regions(self):
+        # Get the current depth frame and colorize it for display
+        depth_frame = self.get_depth_frame()
+        self.normalize_depth_frame(depth_frame)
+        depth_frame = self.colorize_depth_frame(depth_frame, bgr=True)
+
+        # Left click adds a vertex, right click closes the polygon, Enter/Space finishes and Esc cancels
+        regions = []
+        vertices = []
+
+        def on_mouse(event, x, y, flags, param):
+            if event == cv2.EVENT_LBUTTONDOWN:
+                vertices.append((x, y))
+            elif event == cv2.EVENT_RBUTTONDOWN and len(vertices) >= 3:
+                regions.append(np.array(vertices, dtype=np.int32))
+                vertices.clear()
+
+        # Open new window for region selection
+        cv2.namedWindow("Select regions")
+        cv2.setMouseCallback("Select regions", on_mouse)
+        while True:
+            # Draw the closed regions and the polygon being drawn
+            display_frame = depth_frame.copy()
+            cv2.polylines(display_frame, regions, True, (255, 255, 255), 2)
+            if vertices:
+                cv2.polylines(display_frame, [np.array(vertices, dtype=np.int32)], False, (0, 255, 255), 1)
+            cv2.imshow("Select regions", display_frame)
+
+            key = cv2.waitKey(20) & 0xFF
+            if key in (13, 32):
+                if len(vertices) >= 3:
+                    regions.append(np.array(vertices, dtype=np.int32))
+                break
+            elif key == 27:
+                regions.clear()
+                break
+        # Close window when regions are selected
+        cv2.destroyWindow("Select regions")
+
+        # Save the regions, the ROI becomes their bounding rectangle
+        if regions:
+            self.roi_regions = regions
+            self.roi_points = cv2.boundingRect(np.concatenate(regions))
+            self.rasterize_roi_regions()
+
+    def rasterize_roi_regions(self):
+        if not self.roi_regions:
+            self.region_indices = None
+            self.region_frame_indices = None
+            self.region_labels = None
+            self.region_union_mask = None
+            return
+
+        # Rasterize every region once inside the ROI
+        x, y, w, h = self.roi_points
+        region_indices = []
+        for region in self.roi_regions:
+            mask = np.zeros((h, w), dtype=np.uint8)
+            cv2.fillPoly(mask, [region - (x, y)], 1)
+            region_indices.append(np.flatnonzero(mask))
+
+        # Concatenate the regions so every statistic is a single take and bincount, overlapping pixels count in every region
+        self.region_indices = np.concatenate(region_indices)
+        self.region_labels = np.repeat(np.arange(len(region_indices)), [len(indices) for indices in region_indices])
+        rows, cols = np.divmod(self.region_indices, w)
+        self.region_frame_indices = (rows + y) * 640 + cols + x
+        self.region_union_mask = np.zeros((h, w), dtype=bool)
+        self.region_union_mask.ravel()[self.region_indices] = True
+
+    def compute_region_sums(self, values, frame_indices=False):
+        # Gather the region pixels once and sum them per region
+        indices = self.region_frame_indices if frame_indices else self.region_indices
+        region_values = values.ravel().take(indices)
+        num_regions = len(self.roi_regions)
+        sums = np.bincount(self.region_labels, weights=region_values, minlength=num_regions)
+        counts = np.bincount(self.region_labels, weights=region_values != 0, minlength=num_regions)
+        return sums, counts
+
+    def compute_region_volume_change(self, depth_image):
+        # Difference against the baseline, ignoring pixels that are invalid in either frame
+        baseline = self.baseline_depth_array.ravel().take(self.region_frame_indices)
+        current = depth_image.ravel().take(self.region_frame_indices)
+        difference = np.where((baseline > 0) & (current > 0), baseline - current, 0)
+        # Sum every region and convert the sum to liters
+        sums = np.bincount(self.region_labels, weights=difference, minlength=len(self.roi_regions))
+        return sums * self.depth_scale / 1e3
+
+    ##########################################################################################################################
+    # Tiled erosion map functions
+    def compute_tile_volume_change(self, depth_image):
+        # Get the tiled region, the ROI is cropped to a whole number of tiles
+        x, y, w, h = self.roi_points if self.roi_points is not None else (0, 0, 640, 480)
+        rows, cols = self.tile_grid
+        tile_h, tile_w = h // rows, w // cols
+        if tile_h == 0 or tile_w == 0:
+            return None
+
+        baseline = self.baseline_depth_array[y:y + tile_h * rows, x:x + tile_w * cols]
+        current = depth_image[y:y + tile_h * rows, x:x + tile_w * cols]
+
+        # Calculate the difference, ignoring pixels that are invalid in either frame
+        difference = baseline - current
+        difference[(baseline == 0) | (current == 0)] = 0
+
+        # Sum every tile by reshaping the region into blocks and convert the sum to liters
+        tile_sums = difference.reshape(rows, tile_h, cols, tile_w).sum(axis=(1, 3))
+        return tile_sums * self.depth_scale / 1e3
+
+    def render_erosion_heat_map(self):
+        # Map the tile volume changes symmetrically around zero to 0-255
+        max_change = np.max(np.abs(self.tile_volume_change))
+        if max_change > 0:
+            tile_image = np.clip(self.tile_volume_change / max_change * 127.5 + 127.5, 0, 255).astype(np.uint8)
+        else:
+            tile_image = np.full(self.tile_volume_change.shape, 128, dtype=np.uint8)
+        # Color the tiles and convert the result to RGB
+        tile_colors = cv2.cvtColor(cv2.applyColorMap(tile_image, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+        self.erosion_heat_map = tile_colors
+
+    def save_tile_time_series(self):
+        # Write the tile volume changes with one row per frame and one column per tile
+        if not self.tile_time_series:
+            return
+        rows, cols = self.tile_grid
+        header = "timestamp," + ",".join("tile_{}_{}".format(r, c) for r in range(rows) for c in range(cols))
+        time_series = np.array([[timestamp, *tiles.ravel()] for timestamp, tiles in self.tile_time_series])
+        np.savetxt("data/tiles{}.csv".format(self.recording_conuter), time_series, delimiter=",", header=header, comments="", fmt="%.6f")
+
+    ##########################################################################################################################
+    # Noise statistics functions
+    def update_noise_statistics(self, depth_image):
+        # Only valid (non-zero) pixels are counted
+        np.greater(depth_image, 0, out=self.noise_valid)
+        np.add(self.noise_count, self.noise_valid, out=self.noise_count, casting='unsafe')
+        # Update the running mean with the deviation from the previous mean
+        np.subtract(depth_image, self.noise_mean, out=self.noise_delta)
+        np.divide(self.noise_delta, self.noise_count, out=self.noise_scratch, where=self.noise_valid)
+        np.add(self.noise_mean, self.noise_scratch, out=self.noise_mean, where=self.noise_valid)
+        # Update the sum of squared deviations with the deviation from the new mean
+        np.subtract(depth_image, self.noise_mean, out=self.noise_scratch)
+        np.multiply(self.noise_delta, self.noise_scratch, out=self.noise_scratch)
+        np.add(self.noise_m2, self.noise_scratch, out=self.noise_m2, where=self.noise_valid)
+
+    def reset_noise_statistics(self):
+        self.noise_count.fill(0)
+        self.noise_mean.fill(0)
+        self.noise_m2.fill(0)
+
+    def get_noise_sigma(self):
+        # Sample standard deviation in meters, pixels with less than two samples are unknown (NaN)
+        noise_sigma = np.full((480, 640), np.nan, dtype=np.float32)
+        known = self.noise_count > 1
+        noise_sigma[known] = np.sqrt(self.noise_m2[known] / (self.noise_count[known] - 1)) * self.depth_scale
+        return noise_sigma
 
     ##########################################################################################################################
     # Recording functions
+    def create_video_writers(self, rgb_path, depth_path):
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        rgb_video = cv2.VideoWriter(rgb_path, fourcc, 15.0, (640, 480))
+        depth_video = cv2.VideoWriter(depth_path, fourcc, 15.0, (640, 480), isColor=False)
+        return rgb_video, depth_video
+
     def start_recording(self):
+        # Count the frames rejected because of vibration during this measurement
+        self.rejected_frames = 0
+
         # Check if average frame is enabled
         if self.frame_averaging_enabled:
             # Get the average depth frame
             self.first_depth_frame = self.calculate_average_depth_frame()
         else:
             # Get current depth frame
-            self.first_depth_frame = self.get_depth_frame()
+            self.first_depth_frame = self.get_stable_depth_frame()
 
         # Check if ROI is selected and crop the real depth frame
         if self.roi_points is not None:
@@ -181,26 +640,103 @@ class RealSenseCamera:
         else:
             self.real_first_depth_frame = self.get_real_depth_frame()
 
+        # Keep the baseline depth array for the tiled erosion map
+        if self.frame_averaging_enabled:
+            self.baseline_depth_array = self.first_depth_frame.astype(np.float32)
+        else:
+            self.baseline_depth_array = np.asanyarray(self.first_depth_frame.get_data()).astype(np.float32)
+        self.tile_grid = (self.tile_rows, self.tile_cols)
+        self.tile_time_series = []
+        self.erosion_heat_map = None
+
         # Record depth and rgb frames to a folder videos
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        self.rgb_video = cv2.VideoWriter('data/rgb{}.avi'.format(self.recording_conuter), fourcc, 15.0, (640, 480))
-        self.depth_video = cv2.VideoWriter('data/depth{}.avi'.format(self.recording_conuter), fourcc, 15.0, (640, 480), isColor=False)
+        self.rgb_video, self.depth_video = self.create_video_writers('data/rgb{}.avi'.format(self.recording_conuter),
+                                                                    'data/depth{}.avi'.format(self.recording_conuter))
 
         self.recording = True
 
+    def prepare_threshold_sweep(self):
+        # Sort the real difference frame once, every threshold is then a binary search
+        # Only the pixels inside the regions are swept if selected, like in the volume change
+        real_difference = self.real_difference_depth_frame.ravel()
+        if self.roi_regions:
+            pixels = np.flatnonzero(self.region_union_mask)
+        else:
+            pixels = np.arange(real_difference.size)
+
+        # Pixels with a noise-based threshold do not depend on the slider, they are evaluated once with the same
+        # threshold map as the recorded measurement and only the other pixels are swept
+        if self.sweep_auto_mask is not None:
+            auto = self.sweep_auto_mask.ravel()[pixels]
+            auto_pixels = pixels[auto]
+            self.sweep_fixed_pixels = auto_pixels[real_difference[auto_pixels] > self.sweep_auto_threshold.ravel()[auto_pixels]]
+            pixels = pixels[~auto]
+        else:
+            self.sweep_fixed_pixels = np.empty(0, dtype=np.intp)
+        self.sweep_fixed_sum = np.sum(real_difference[self.sweep_fixed_pixels], dtype=np.float64)
+
+        self.sweep_order = pixels[np.argsort(real_difference[pixels], kind="stable")]
+        self.sweep_sorted_diff = real_difference[self.sweep_order]
+        self.sweep_cumsum = np.cumsum(self.sweep_sorted_diff, dtype=np.float64)
+        self.sweep_base_frame = cv2.cvtColor(self.normalized_diff_frame, cv2.COLOR_GRAY2RGB)
+
+        # Create the threshold sweep window
+        if self.sweep_window is None or not self.sweep_window.winfo_exists():
+            self.sweep_window = tk.Toplevel(self.canvas)
+            self.sweep_window.title("Threshold sweep")
+            self.sweep_image_label = tk.Label(self.sweep_window)
+            self.sweep_image_label.grid(row=0, column=0, padx=10, pady=5)
+            self.sweep_info_label = tk.Label(self.sweep_window, font=("Helvetica", 12))
+            self.sweep_info_label.grid(row=1, column=0, padx=10, pady=5)
+
+        self.update_threshold_sweep()
+
+    def update_threshold_sweep(self):
+        if self.sweep_order is None or self.sweep_window is None or not self.sweep_window.winfo_exists():
+            return
+
+        # Pixels above the threshold are the tail of the sorted difference values, plus the pixels changed by their noise-based threshold
+        first_changed = np.searchsorted(self.sweep_sorted_diff, self.volume_change_threshold, side="right")
+        changed_count = self.sweep_sorted_diff.size - first_changed + self.sweep_fixed_pixels.size
+        total_sum = self.sweep_cumsum[-1] if self.sweep_cumsum.size else 0.0
+        unchanged_sum = self.sweep_cumsum[first_changed - 1] if first_changed > 0 else 0.0
+        masked_volume_change = (total_sum - unchanged_sum + self.sweep_fixed_sum) / 1e3
+
+        # Highlight the changed pixels on a copy of the difference frame
+        overlay = self.sweep_base_frame.copy()
+        overlay.reshape(-1, 3)[self.sweep_order[first_changed:]] = [255, 0, 0]
+        overlay.reshape(-1, 3)[self.sweep_fixed_pixels] = [255, 0, 0]
+
+        # Update the threshold sweep window
+        self.sweep_photo = ImageTk.PhotoImage(Image.fromarray(overlay))
+        self.sweep_image_label.configure(image=self.sweep_photo)
+        threshold_text = "{:.2f}".format(self.volume_change_threshold)
+        if self.sweep_auto_mask is not None:
+            threshold_text = threshold_text + " (noise-based where known)"
+        self.sweep_info_label.configure(text="Threshold: {}   Changed pixels: {}   Masked volume change: {:.1f} liters".format(
+            threshold_text, changed_count, masked_volume_change))
+
+    def set_volume_change_threshold(self, value):
+        self.volume_change_threshold = float(value)
+        self.update_threshold_sweep()
+
     def stop_recording(self):
         # Release the video objects
         self.recording = False
         self.rgb_video.release()
         self.depth_video.release()
 
+        # Save the tile volume changes recorded during the measurement
+        if self.erosion_map_enabled:
+            self.save_tile_time_series()
+
         # Check if average frame is enabled
         if self.frame_averaging_enabled:
             # Get the average depth frame
             self.last_depth_frame = self.calculate_average_depth_frame()
         else:
             # Get current depth frame
-            self.last_depth_frame = self.get_depth_frame()
+            self.last_depth_frame = self.get_stable_depth_frame()
 
         # Check if ROI is selected and crop the real depth frame
         if self.roi_points is not None:
@@ -225,12 +761,50 @@ class RealSenseCamera:
 
         self.real_difference_depth_frame = self.real_first_depth_frame - self.real_last_depth_frame
 
-        # Calculate the change in volume between the last and first depth frames
-        self.volume_change = np.sum(self.real_difference_depth_frame) / 1e3
-        print("Volume change is {:.1f} liters".format(self.volume_change))
+        # Calculate the change in volume between the last and first depth frames, only inside the regions if selected
+        if self.roi_regions:
+            self.volume_change = np.sum(self.real_difference_depth_frame[self.region_union_mask]) / 1e3
+            region_sums, _ = self.compute_region_sums(self.real_difference_depth_frame)
+            self.region_volume_change = region_sums / 1e3
+        else:
+            self.volume_change = np.sum(self.real_difference_depth_frame) / 1e3
+            self.region_volume_change = None
 
-        # Find out which pixels have changed
-        self.changed_pixels = np.where(self.real_difference_depth_frame > self.volume_change_threshold)
+        # Get the noise of the difference from the idle noise statistics, both real depth frames are single frames
+        noise_sigma = self.get_noise_sigma()
+        if self.roi_points is not None:
+            x, y, w, h = self.roi_points
+            noise_sigma = noise_sigma[y:y + h, x:x + w]
+        difference_sigma = np.sqrt(2) * noise_sigma
+        known_sigma = ~np.isnan(difference_sigma)
+        if self.roi_regions:
+            known_sigma &= self.region_union_mask
+
+        # Calculate the 95% confidence interval of the volume change assuming independent pixel noise
+        if known_sigma.any():
+            self.volume_change_confidence = 1.96 * np.sqrt(np.sum(difference_sigma[known_sigma] ** 2)) / 1e3
+            volume_change_text = "{:.1f} +/- {:.1f} liters (95% CI)".format(self.volume_change, self.volume_change_confidence)
+        else:
+            self.volume_change_confidence = None
+            volume_change_text = "{:.1f} liters".format(self.volume_change)
+        print("Volume change is {}".format(volume_change_text))
+
+        # Find out which pixels have changed, using the noise-based threshold where the noise is known
+        if self.auto_threshold_enabled and known_sigma.any():
+            volume_change_threshold = np.where(known_sigma, self.noise_threshold_sigmas * difference_sigma, self.volume_change_threshold)
+            threshold_text = "{:.4f} (auto, {:.1f} sigma median)".format(np.median(volume_change_threshold), self.noise_threshold_sigmas)
+            # The threshold sweep keeps the noise-based threshold where it is known
+            self.sweep_auto_mask = known_sigma
+            self.sweep_auto_threshold = volume_change_threshold
+        else:
+            volume_change_threshold = self.volume_change_threshold
+            threshold_text = "{:.2f}".format(self.volume_change_threshold)
+            self.sweep_auto_mask = None
+            self.sweep_auto_threshold = None
+        changed = self.real_difference_depth_frame > volume_change_threshold
+        if self.roi_regions:
+            changed &= self.region_union_mask
+        self.changed_pixels = np.where(changed)
 
         # Normalize the differnce depth frame
         q1 = np.percentile(self.difference_depth_frame, 25)
@@ -261,12 +835,20 @@ class RealSenseCamera:
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
+        # Keep the sorted difference frame so the threshold slider can be swept without recording again
+        self.prepare_threshold_sweep()
+
         # Write the volume change to the measurements log
         self.measurements_log.insert(tk.END, "Recorded meassurement {}: \n".format(self.recording_conuter))
         self.measurements_log.insert(tk.END, "Frame averaging enabled: {}\n".format(self.frame_averaging_enabled))
         self.measurements_log.insert(tk.END, "Number of frames: {}\n".format(self.num_frames))
-        self.measurements_log.insert(tk.END, "Volume change threshold: {:.2f}\n".format(self.volume_change_threshold))
-        self.measurements_log.insert(tk.END, "Volume change: {:.1f} liters\n".format(self.volume_change))
+        self.measurements_log.insert(tk.END, "Rejected vibrating frames: {}\n".format(self.rejected_frames))
+        self.measurements_log.insert(tk.END, "Baseline mode: {}\n".format(self.baseline_mode))
+        self.measurements_log.insert(tk.END, "Volume change threshold: {}\n".format(threshold_text))
+        self.measurements_log.insert(tk.END, "Volume change: {}\n".format(volume_change_text))
+        if self.region_volume_change is not None:
+            for i, region_volume_change in enumerate(self.region_volume_change):
+                self.measurements_log.insert(tk.END, "Region {} volume change: {:.1f} liters\n".format(i + 1, region_volume_change))
         self.measurements_log.insert(tk.END, "Timestamp: {}\n".format(str(datetime.datetime.now())))
         self.measurements_log.insert(tk.END, "----------------------------------------\n")
         self.measurements_log.see(tk.END)
@@ -276,15 +858,113 @@ class RealSenseCamera:
             f.write("Recorded meassurement {}: \n".format(self.recording_conuter))
             f.write("Frame averaging enabled: {}\n".format(self.frame_averaging_enabled))
             f.write("Number of frames: {}\n".format(self.num_frames))
-            f.write("Volume change threshold: {:.2f}\n".format(self.volume_change_threshold))
-            f.write("Volume change: {:.1f} liters\n".format(self.volume_change))
+            f.write("Rejected vibrating frames: {}\n".format(self.rejected_frames))
+            f.write("Baseline mode: {}\n".format(self.baseline_mode))
+            f.write("Volume change threshold: {}\n".format(threshold_text))
+            f.write("Volume change: {}\n".format(volume_change_text))
+            if self.region_volume_change is not None:
+                for i, region_volume_change in enumerate(self.region_volume_change):
+                    f.write("Region {} volume change: {:.1f} liters\n".format(i + 1, region_volume_change))
             f.write("Timestamp: {}\n".format(str(datetime.datetime.now())))
             f.write("----------------------------------------\n")
 
+        # Start collecting new noise statistics for the next measurement
+        self.reset_noise_statistics()
+
         # Increment the recording counter
         self.recording_conuter = self.recording_conuter + 1
 
 
+    ##########################################################################################################################
+    # Event-triggered recording functions
+    def set_auto_record_enabled(self, enabled):
+        if enabled:
+            # Capture the baseline the change metric is compared against
+            self.auto_record_baseline = self.calculate_average_depth_frame().astype(np.float32)
+            self.preroll_buffer.clear()
+        elif self.auto_recording:
+            self.stop_auto_record_segment()
+        self.auto_record_enabled = enabled
+
+    def compute_change_metric(self, depth_image, reference):
+        # Downsample the ROI (or the whole frame) with a stride, both frames are only sliced, not copied
+        x, y, w, h = self.roi_points if self.roi_points is not None else (0, 0, 640, 480)
+        stride = self.auto_record_stride
+        baseline = reference[y:y + h:stride, x:x + w:stride]
+        current = depth_image[y:y + h:stride, x:x + w:stride]
+        # Mean absolute depth change in meters over pixels valid in both frames
+        valid = (baseline > 0) & (current > 0)
+        if not valid.any():
+            return 0.0
+        return np.mean(np.abs(baseline[valid] - current[valid])) * self.depth_scale
+
+    def update_change_reference(self, depth_image):
+        # Exponential moving average of the valid pixels, it follows the surface as it erodes
+        current = depth_image.astype(np.float32)
+        valid = current > 0
+        self.auto_record_reference[valid] += self.auto_record_reference_weight * (current[valid] - self.auto_record_reference[valid])
+
+    def update_auto_record(self, depth_image):
+        now = time.monotonic()
+
+        if not self.auto_recording:
+            # A recording starts when the surface changed against the baseline
+            change_metric = self.compute_change_metric(depth_image, self.auto_record_baseline)
+            # Keep the last frames for the pre-roll, the RGB frame buffer is reused by the camera
+            self.preroll_buffer.append((self.rgb_frame.copy(), self.normalized_depth_frame))
+            if change_metric <= self.auto_record_threshold:
+                return
+
+            # Start a new segment and write the pre-roll frames
+            print("Auto recording segment {} started, change: {:.4f} m".format(self.auto_record_segment, change_metric))
+            self.auto_rgb_video, self.auto_depth_video = self.create_video_writers('data/auto_rgb{}.avi'.format(self.auto_record_segment),
+                                                                                  'data/auto_depth{}.avi'.format(self.auto_record_segment))
+            for rgb_frame, normalized_depth_frame in self.preroll_buffer:
+                self.auto_rgb_video.write(rgb_frame)
+                self.auto_depth_video.write(normalized_depth_frame)
+            self.preroll_buffer.clear()
+            self.auto_recording = True
+            self.auto_record_start = datetime.datetime.now()
+            self.auto_record_last_change = now
+            self.auto_record_reference = depth_image.astype(np.float32)
+            return
+
+        # Write the current frame to the segment
+        self.auto_rgb_video.write(self.rgb_frame)
+        self.auto_depth_video.write(self.normalized_depth_frame)
+
+        # Stop the segment after the quiet period, the change is measured against the recent frames and not the
+        # baseline, otherwise the eroded surface would keep the recording running after the change stopped
+        change_metric = self.compute_change_metric(depth_image, self.auto_record_reference)
+        self.update_change_reference(depth_image)
+        if change_metric > self.auto_record_threshold:
+            self.auto_record_last_change = now
+        elif now - self.auto_record_last_change > self.auto_record_quiet_period:
+            self.stop_auto_record_segment()
+
+    def stop_auto_record_segment(self):
+        # Release the video objects
+        self.auto_recording = False
+        self.auto_rgb_video.release()
+        self.auto_depth_video.release()
+        print("Auto recording segment {} stopped".format(self.auto_record_segment))
+
+        # Write the segment to the measurements log
+        self.measurements_log.insert(tk.END, "Auto recorded segment {}: \n".format(self.auto_record_segment))
+        self.measurements_log.insert(tk.END, "Started: {}\n".format(str(self.auto_record_start)))
+        self.measurements_log.insert(tk.END, "Stopped: {}\n".format(str(datetime.datetime.now())))
+        self.measurements_log.insert(tk.END, "----------------------------------------\n")
+        self.measurements_log.see(tk.END)
+
+        # The settled surface is the baseline of the next segment
+        if self.auto_record_reference is not None:
+            self.auto_record_baseline = self.auto_record_reference
+            self.auto_record_reference = None
+
+        # Increment the segment counter
+        self.auto_record_segment = self.auto_record_segment + 1
+
+
     ##########################################################################################################################
     # Window update function
     def update(self):
@@ -296,8 +976,37 @@ class RealSenseCamera:
             # Save current RGB frame
             self.rgb_frame = rgb_frame
 
-            # Save current depth frame and normalize it
+            # Save current depth frame, normalize and colorize it
             self.normalized_depth_frame = self.normalize_depth_frame(depth_frame)
+            self.colorized_depth_frame = self.colorize_depth_frame(depth_frame)
+
+            # Frames captured during vibration are excluded from the statistics and volume calculations
+            frame_stable = self.is_frame_stable(depth_frame)
+
+            # Update the noise statistics while idle
+            if not self.recording and not self.auto_recording and frame_stable:
+                self.update_noise_statistics(np.asanyarray(depth_frame.get_data()))
+
+            # Update the event-triggered recording when not recording manually
+            if self.auto_record_enabled and not self.recording:
+                self.update_auto_record(np.asanyarray(depth_frame.get_data()))
+
+            # Update the tiled erosion map while recording
+            if self.erosion_map_enabled and self.recording and frame_stable:
+                self.tile_volume_change = self.compute_tile_volume_change(np.asanyarray(depth_frame.get_data()))
+                if self.tile_volume_change is not None:
+                    self.tile_time_series.append((depth_frame.get_timestamp() / 1e3, self.tile_volume_change))
+                    self.render_erosion_heat_map()
+
+            # Update the region volume changes while recording
+            if self.roi_regions and self.recording and frame_stable:
+                region_volume_change = self.compute_region_volume_change(np.asanyarray(depth_frame.get_data()))
+                self.region_stats_label.configure(text="  ".join("Region {}: {:.2f} L".format(i + 1, volume)
+                                                                 for i, volume in enumerate(region_volume_change)))
+
+            # Publish the frames to browser clients
+            if self.stream_server is not None:
+                self.publish_stream_frames()
 
             # Display the frames in the Tkinter window
             self.display_frames_tkinter()
@@ -305,6 +1014,13 @@ class RealSenseCamera:
             # Schedule the update method to be called after a delay
             self.canvas.after(10, self.update)
 
+    ##########################################################################################################################
+    # Streaming functions
+    def publish_stream_frames(self):
+        # Frames are encoded once in the stream server worker pool, independent of the number of clients
+        self.stream_server.publish("rgb", self.rgb_frame)
+        self.stream_server.publish("depth", self.colorized_depth_frame, cv2.COLOR_RGB2BGR)
+
     ##########################################################################################################################
     # Display function
     def display_frames_tkinter(self):
@@ -314,20 +1030,36 @@ class RealSenseCamera:
             # Write depth frame to video
             self.depth_video.write(self.normalized_depth_frame)
 
+        # The colorized depth image is already in RGB format
+        depth_image_rgb = self.colorized_depth_frame
+
+        # Blend the erosion heat map over the tiled region
+        if self.erosion_map_enabled and self.erosion_heat_map is not None:
+            x_tiles, y_tiles, w_tiles, h_tiles = self.roi_points if self.roi_points is not None else (0, 0, 640, 480)
+            rows, cols = self.tile_grid
+            w_tiles, h_tiles = w_tiles // cols * cols, h_tiles // rows * rows
+            heat_map = cv2.resize(self.erosion_heat_map, (w_tiles, h_tiles), interpolation=cv2.INTER_NEAREST)
+            tiled_region = depth_image_rgb[y_tiles:y_tiles + h_tiles, x_tiles:x_tiles + w_tiles]
+            depth_image_rgb[y_tiles:y_tiles + h_tiles, x_tiles:x_tiles + w_tiles] = cv2.addWeighted(heat_map, 0.4, tiled_region, 0.6, 0)
+
+        # Convert depth image to PIL format
+        depth_image = Image.fromarray(depth_image_rgb)
+
+        # Check if regions are selected for depth image
+        if self.roi_regions:
+            # Create a drawing object for depth image
+            draw_depth = ImageDraw.Draw(depth_image)
+            # Draw white outlines of the regions on the depth image
+            for region in self.roi_regions:
+                draw_depth.polygon([tuple(point) for point in region.tolist()], outline=(255, 255, 255))
         # Check if ROI is selected for depth image
-        if self.roi_points is not None:
+        elif self.roi_points is not None:
             # Get ROI points for depth image
             x_depth, y_depth, w_depth, h_depth = self.roi_points
-            # Convert depth image to RGB format for PIL
-            depth_image_rgb = Image.fromarray(cv2.cvtColor(self.normalized_depth_frame, cv2.COLOR_GRAY2RGB))
             # Create a drawing object for depth image
-            draw_depth = ImageDraw.Draw(depth_image_rgb)
-            # Draw blue rectangle on the depth image using ROI points
-            draw_depth.rectangle([x_depth, y_depth, x_depth + w_depth, y_depth + h_depth], outline=(0, 0, 255), width=2)
-            # Use the modified depth image with the rectangle
-            depth_image = depth_image_rgb
-        else:
-            depth_image = Image.fromarray(self.normalized_depth_frame)
+            draw_depth = ImageDraw.Draw(depth_image)
+            # Draw white rectangle on the depth image using ROI points, blue is part of the depth colormap
+            draw_depth.rectangle([x_depth, y_depth, x_depth + w_depth, y_depth + h_depth], outline=(255, 255, 255), width=2)
 
         # Convert frames to RGB format for PIL
         rgb_image = Image.fromarray(cv2.cvtColor(self.rgb_frame, cv2.COLOR_BGR2RGB))
@@ -404,13 +1136,62 @@ class RealSenseCamera:
         # Add numeric input field and set the value to self.num_frames and always update self.num_frames when the value is changed
         num_frames_var = tk.IntVar()
         num_frames_scale = tk.Scale(buttons_frame,
-                                    from_=1, to=100,
+                                    from_=1, to=self.max_num_frames,
                                     variable=num_frames_var,
                                     orient=tk.HORIZONTAL,
                                     command=lambda value: setattr(self, 'num_frames', num_frames_var.get()))
         num_frames_scale.set(self.num_frames)  # Set the initial value
         num_frames_scale.grid(row=0, column=1, padx=10, pady=5)
 
+        # Add the baseline mode selection and the trim fraction for the trimmed mean
+        baseline_mode_var = tk.StringVar(value=self.baseline_mode)
+        baseline_mode_menu = tk.OptionMenu(buttons_frame,
+                                           baseline_mode_var,
+                                           "mean", "median", "trimmed mean",
+                                           command=lambda value: setattr(self, 'baseline_mode', value))
+        baseline_mode_menu.grid(row=1, column=0, padx=10, pady=5)
+
+        trim_fraction_var = tk.DoubleVar()
+        trim_fraction_scale = tk.Scale(buttons_frame,
+                                       from_=0, to=0.45,
+                                       resolution=0.05,
+                                       variable=trim_fraction_var,
+                                       orient=tk.HORIZONTAL,
+                                       command=lambda value: setattr(self, 'trim_fraction', trim_fraction_var.get()))
+        trim_fraction_scale.set(self.trim_fraction)  # Set the initial value
+        trim_fraction_scale.grid(row=1, column=1, padx=10, pady=5)
+
+        # Add the vibration rejection and the accelerometer and gyro vibration thresholds
+        vibration_rejection_var = tk.IntVar(value=int(self.vibration_rejection_enabled))
+        vibration_rejection_button = tk.Checkbutton(buttons_frame,
+                                                    text="Reject vibrating frames",
+                                                    variable=vibration_rejection_var,
+                                                    state=tk.NORMAL if self.imu_monitor is not None else tk.DISABLED,
+                                                    command=lambda: setattr(self, 'vibration_rejection_enabled', vibration_rejection_var.get() == 1))
+        vibration_rejection_button.grid(row=2, column=0, padx=10, pady=5)
+
+        max_accel_vibration_var = tk.DoubleVar()
+        max_accel_vibration_scale = tk.Scale(buttons_frame,
+                                             from_=0.05, to=2,
+                                             resolution=0.05,
+                                             label="Max vibration [m/s^2]",
+                                             variable=max_accel_vibration_var,
+                                             orient=tk.HORIZONTAL,
+                                             command=lambda value: setattr(self, 'max_accel_vibration', max_accel_vibration_var.get()))
+        max_accel_vibration_scale.set(self.max_accel_vibration)  # Set the initial value
+        max_accel_vibration_scale.grid(row=2, column=1, padx=10, pady=5)
+
+        max_gyro_vibration_var = tk.DoubleVar()
+        max_gyro_vibration_scale = tk.Scale(buttons_frame,
+                                            from_=0.01, to=1,
+                                            resolution=0.01,
+                                            label="Max gyro [rad/s]",
+                                            variable=max_gyro_vibration_var,
+                                            orient=tk.HORIZONTAL,
+                                            command=lambda value: setattr(self, 'max_gyro_vibration', max_gyro_vibration_var.get()))
+        max_gyro_vibration_scale.set(self.max_gyro_vibration)  # Set the initial value
+        max_gyro_vibration_scale.grid(row=3, column=1, padx=10, pady=5)
+
 
         # ROI Control Section
         roi_control_frame = tk.Frame(control_pannel)
@@ -429,6 +1210,13 @@ class RealSenseCamera:
         reset_roi_button = tk.Button(buttons_frame, text="Reset ROI", command=self.reset_roi)
         reset_roi_button.grid(row=0, column=1, padx=10, pady=5)
 
+        select_regions_button = tk.Button(buttons_frame, text="Select Regions", command=self.select_roi_regions)
+        select_regions_button.grid(row=1, column=0, padx=10, pady=5)
+
+        # Region volume changes while recording
+        self.region_stats_label = tk.Label(roi_control_frame, text="", wraplength=350)
+        self.region_stats_label.grid(row=2, column=0, padx=10, pady=5)
+
 
         # Volume calibration
         volume_calibration_frame = tk.Frame(control_pannel)
@@ -448,14 +1236,65 @@ class RealSenseCamera:
                                                  length=200,
                                                  variable=volume_change_threshold_var,
                                                  orient=tk.HORIZONTAL,
-                                                 command=lambda value: setattr(self, 'volume_change_threshold', volume_change_threshold_var.get()))
+                                                 command=lambda value: self.set_volume_change_threshold(volume_change_threshold_var.get()))
         volume_change_threshold_scale.set(self.volume_change_threshold)  # Set the initial value
         volume_change_threshold_scale.grid(row=0, column=0, padx=10, pady=5)
 
+        # Add the noise-based threshold, the slider is only used for pixels without noise statistics when enabled
+        auto_threshold_var = tk.IntVar(value=int(self.auto_threshold_enabled))
+        auto_threshold_button = tk.Checkbutton(buttons_frame,
+                                               text="Automatic noise threshold",
+                                               variable=auto_threshold_var,
+                                               command=lambda: setattr(self, 'auto_threshold_enabled', auto_threshold_var.get() == 1))
+        auto_threshold_button.grid(row=1, column=0, padx=10, pady=5)
+
+        reset_noise_button = tk.Button(buttons_frame, text="Reset noise statistics", command=self.reset_noise_statistics)
+        reset_noise_button.grid(row=1, column=1, padx=10, pady=5)
+
+
+        # Erosion map section
+        erosion_map_frame = tk.Frame(control_pannel)
+        erosion_map_frame.grid(row=4, column=0, padx=10, pady=5)
+        erosion_map_label = tk.Label(erosion_map_frame, text="Erosion Map", font=("Helvetica", 14))
+        erosion_map_label.grid(row=0, column=0, padx=10, pady=5)
+
+        # Buttons Frame
+        buttons_frame = tk.Frame(erosion_map_frame)
+        buttons_frame.grid(row=1, column=0, padx=10, pady=5)
+
+        # Add buttons
+        enable_erosion_map_var = tk.IntVar()
+        enable_erosion_map_button = tk.Checkbutton(buttons_frame,
+                                                   text="Enable Erosion Map",
+                                                   variable=enable_erosion_map_var,
+                                                   command=lambda: setattr(self, 'erosion_map_enabled', enable_erosion_map_var.get() == 1))
+        enable_erosion_map_button.grid(row=0, column=0, columnspan=2, padx=10, pady=5)
+
+        # Add the tile grid size, it is applied when the recording is started
+        tile_rows_var = tk.IntVar()
+        tile_rows_scale = tk.Scale(buttons_frame,
+                                   from_=1, to=16,
+                                   label="Tile rows",
+                                   variable=tile_rows_var,
+                                   orient=tk.HORIZONTAL,
+                                   command=lambda value: setattr(self, 'tile_rows', tile_rows_var.get()))
+        tile_rows_scale.set(self.tile_rows)  # Set the initial value
+        tile_rows_scale.grid(row=1, column=0, padx=10, pady=5)
+
+        tile_cols_var = tk.IntVar()
+        tile_cols_scale = tk.Scale(buttons_frame,
+                                   from_=1, to=16,
+                                   label="Tile columns",
+                                   variable=tile_cols_var,
+                                   orient=tk.HORIZONTAL,
+                                   command=lambda value: setattr(self, 'tile_cols', tile_cols_var.get()))
+        tile_cols_scale.set(self.tile_cols)  # Set the initial value
+        tile_cols_scale.grid(row=1, column=1, padx=10, pady=5)
+
 
         # Recording section
         recording_frame = tk.Frame(control_pannel)
-        recording_frame.grid(row=4, column=0, padx=10, pady=5)
+        recording_frame.grid(row=5, column=0, padx=10, pady=5)
         recording_label = tk.Label(recording_frame, text="Recording control", font=("Helvetica", 14))
         recording_label.grid(row=0, column=0, padx=10, pady=5)
 
@@ -471,9 +1310,50 @@ class RealSenseCamera:
         stop_recording_button.grid(row=0, column=1, padx=10, pady=5)
 
         
+        # Auto recording section
+        auto_record_frame = tk.Frame(control_pannel)
+        auto_record_frame.grid(row=6, column=0, padx=10, pady=5)
+        auto_record_label = tk.Label(auto_record_frame, text="Auto Recording", font=("Helvetica", 14))
+        auto_record_label.grid(row=0, column=0, padx=10, pady=5)
+
+        # Buttons Frame
+        buttons_frame = tk.Frame(auto_record_frame)
+        buttons_frame.grid(row=1, column=0, padx=10, pady=5)
+
+        # Add buttons
+        enable_auto_record_var = tk.IntVar()
+        enable_auto_record_button = tk.Checkbutton(buttons_frame,
+                                                   text="Enable Auto Recording",
+                                                   variable=enable_auto_record_var,
+                                                   command=lambda: self.set_auto_record_enabled(enable_auto_record_var.get() == 1))
+        enable_auto_record_button.grid(row=0, column=0, columnspan=2, padx=10, pady=5)
+
+        # Add the trigger threshold and the quiet period
+        auto_record_threshold_var = tk.DoubleVar()
+        auto_record_threshold_scale = tk.Scale(buttons_frame,
+                                               from_=0.001, to=0.05,
+                                               resolution=0.001,
+                                               label="Trigger change [m]",
+                                               variable=auto_record_threshold_var,
+                                               orient=tk.HORIZONTAL,
+                                               command=lambda value: setattr(self, 'auto_record_threshold', auto_record_threshold_var.get()))
+        auto_record_threshold_scale.set(self.auto_record_threshold)  # Set the initial value
+        auto_record_threshold_scale.grid(row=1, column=0, padx=10, pady=5)
+
+        auto_record_quiet_period_var = tk.DoubleVar()
+        auto_record_quiet_period_scale = tk.Scale(buttons_frame,
+                                                  from_=1, to=60,
+                                                  label="Quiet period [s]",
+                                                  variable=auto_record_quiet_period_var,
+                                                  orient=tk.HORIZONTAL,
+                                                  command=lambda value: setattr(self, 'auto_record_quiet_period', auto_record_quiet_period_var.get()))
+        auto_record_quiet_period_scale.set(self.auto_record_quiet_period)  # Set the initial value
+        auto_record_quiet_period_scale.grid(row=1, column=1, padx=10, pady=5)
+
+
         # Meassurements log section
         measurements_log_frame = tk.Frame(control_pannel)
-        measurements_log_frame.grid(row=5, column=0, padx=10, pady=5)
+        measurements_log_frame.grid(row=7, column=0, padx=10, pady=5)
         measurements_log_label = tk.Label(measurements_log_frame, text="Measurements", font=("Helvetica", 14))
         measurements_log_label.grid(row=0, column=0, padx=10, pady=5)
 
@@ -496,7 +1376,7 @@ class RealSenseCamera:
 
         # Delete contents of the data folder
         delete_data_folder_button = tk.Button(control_pannel, text="Delete data folder", command=lambda: os.system("rm -rf data/*"))
-        delete_data_folder_button.grid(row=6, column=0, padx=10, pady=5)
+        delete_data_folder_button.grid(row=8, column=0, padx=10, pady=5)
 
 
         # Create the frames for the RGB and depth streams
@@ -514,10 +1394,53 @@ class RealSenseCamera:
 
         # Stop the RealSense pipeline when the Tkinter window is closed
         self.pipeline.stop()
+        if self.imu_monitor is not None:
+            self.imu_monitor.stop()
+
+    def run_headless(self):
+        self.is_running = True
+        print("Running headless, press Ctrl+C to stop")
+        try:
+            while self.is_running:
+                # Get current frames and publish them to browser clients
+                self.rgb_frame = self.get_rgb_frame()
+                depth_frame = self.get_depth_frame()
+                self.normalized_depth_frame = self.normalize_depth_frame(depth_frame)
+                self.colorized_depth_frame = self.colorize_depth_frame(depth_frame)
+                self.publish_stream_frames()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Stop the RealSense pipeline when the capture loop is stopped
+            self.is_running = False
+            self.pipeline.stop()
+            if self.imu_monitor is not None:
+                self.imu_monitor.stop()
 
 
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RealSense Camera GUI")
+    parser.add_argument("--stream", action="store_true", help="Stream the RGB and depth frames to browsers over MJPEG")
+    parser.add_argument("--headless", action="store_true", help="Run without the Tkinter window, implies --stream")
+    parser.add_argument("--host", default="0.0.0.0", help="Address of the stream server")
+    parser.add_argument("--port", type=int, default=8080, help="Port of the stream server")
+    parser.add_argument("--stream-workers", type=int, default=2, help="Number of stream encoding workers")
+    args = parser.parse_args()
+
     camera = RealSenseCamera()
-    camera.run()
+
+    # Start the stream server if enabled
+    if args.stream or args.headless:
+        camera.stream_server = StreamServer(args.host, args.port, args.stream_workers)
+        camera.stream_server.start()
+
+    try:
+        if args.headless:
+            camera.run_headless()
+        else:
+            camera.run()
+    finally:
+        if camera.stream_server is not None:
+            camera.stream_server.stop()
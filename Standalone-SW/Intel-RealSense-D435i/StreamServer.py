@@ -0,0 +1,206 @@
+import threading, cv2
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FrameBroadcaster:
+    """
+    Class for broadcasting the latest encoded frame of one stream to any number of clients
+    Methods:
+        __init__(): Initialize the broadcaster object
+        publish(): Encode a frame in the worker pool unless the previous frame is still being encoded
+        encode(): Encode a frame to JPEG and notify the waiting clients
+        wait_for_frame(): Wait for a frame newer than the last one sent to the client
+        close(): Wake up all waiting clients so they can disconnect
+
+    Attributes:
+        executor: Worker pool used for encoding
+        jpeg_quality: JPEG quality of the encoded frames
+        condition: Condition used to notify clients about new frames
+        jpeg: Latest encoded frame
+        sequence: Sequence number of the latest encoded frame
+        encoding: Boolean for encoding status of the previous frame
+        num_clients: Number of connected clients
+        closed: Boolean for broadcaster status
+    """
+
+    def __init__(self, executor, jpeg_quality=80):
+        self.executor = executor
+        self.jpeg_quality = jpeg_quality
+        self.condition = threading.Condition()
+        self.jpeg = None
+        self.sequence = 0
+        self.encoding = False
+        self.num_clients = 0
+        self.closed = False
+
+    def publish(self, frame, color_conversion=None):
+        # Skip the frame when nobody is watching or the previous frame is still being encoded
+        with self.condition:
+            if self.num_clients == 0 or self.encoding or self.closed:
+                return False
+            self.encoding = True
+        # Copy the frame since the camera reuses its frame buffers
+        self.executor.submit(self.encode, frame.copy(), color_conversion)
+        return True
+
+    def encode(self, frame, color_conversion=None):
+        jpeg = None
+        try:
+            # Convert the color order in the worker, not in the capture loop
+            if color_conversion is not None:
+                frame = cv2.cvtColor(frame, color_conversion)
+            success, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if success:
+                jpeg = encoded.tobytes()
+        finally:
+            # Every client gets the same encoded frame
+            with self.condition:
+                self.encoding = False
+                if jpeg is not None:
+                    self.jpeg = jpeg
+                    self.sequence = self.sequence + 1
+                    self.condition.notify_all()
+
+    def wait_for_frame(self, last_sequence, timeout=5.0):
+        # Clients that were too slow skip directly to the latest frame
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence or self.closed, timeout)
+            return self.sequence, self.jpeg
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class StreamServer:
+    """
+    Class for streaming the RGB and depth frames to browsers over MJPEG
+    Methods:
+        __init__(): Initialize the stream server object
+        start(): Start serving clients in a background thread
+        stop(): Stop serving clients and the encoding worker pool
+        publish(): Publish a frame to one of the streams
+        create_handler(): Create the HTTP request handler bound to this server
+
+    Attributes:
+        executor: Worker pool shared by all streams for encoding
+        broadcasters: Broadcaster of every stream by name
+        httpd: HTTP server object
+        thread: Thread running the HTTP server
+    """
+
+    # Page with both streams, relative URLs keep it working behind a reverse proxy prefix
+    INDEX_PAGE = b"""<!DOCTYPE html>
+<html>
+<head><title>RealSense Camera Stream</title></head>
+<body>
+<h1>RealSense Camera Stream</h1>
+<img src="rgb.mjpg" alt="RGB stream">
+<img src="depth.mjpg" alt="Depth stream">
+</body>
+</html>
+"""
+
+    def __init__(self, host="0.0.0.0", port=8080, num_workers=2, jpeg_quality=80):
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="stream-encoder")
+        self.broadcasters = {
+            "rgb": FrameBroadcaster(self.executor, jpeg_quality),
+            "depth": FrameBroadcaster(self.executor, jpeg_quality),
+        }
+        self.httpd = ThreadingHTTPServer((host, port), self.create_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        print("Starting stream server on http://{}:{}".format(*self.httpd.server_address))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="stream-server", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        print("Stopping stream server")
+        for broadcaster in self.broadcasters.values():
+            broadcaster.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.executor.shutdown(wait=False)
+
+    def publish(self, name, frame, color_conversion=None):
+        return self.broadcasters[name].publish(frame, color_conversion)
+
+    def create_handler(self):
+        server = self
+
+        class StreamRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                # Do not print every request
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+                if path in ("", "index.html"):
+                    self.send_index()
+                elif path.endswith(".mjpg") and path[:-5] in server.broadcasters:
+                    self.send_stream(server.broadcasters[path[:-5]])
+                elif path.endswith(".jpg") and path[:-4] in server.broadcasters:
+                    self.send_snapshot(server.broadcasters[path[:-4]])
+                else:
+                    self.send_error(404)
+
+            def send_index(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(server.INDEX_PAGE)))
+                self.end_headers()
+                self.wfile.write(server.INDEX_PAGE)
+
+            def send_snapshot(self, broadcaster):
+                # Frames are only encoded while clients are connected, so the cached frame may be old
+                # Register as a client and wait for a frame encoded after the request
+                with broadcaster.condition:
+                    broadcaster.num_clients = broadcaster.num_clients + 1
+                    sequence = broadcaster.sequence
+                try:
+                    new_sequence, jpeg = broadcaster.wait_for_frame(sequence)
+                finally:
+                    with broadcaster.condition:
+                        broadcaster.num_clients = broadcaster.num_clients - 1
+                if jpeg is None or new_sequence == sequence:
+                    self.send_error(503)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(jpeg)))
+                self.end_headers()
+                self.wfile.write(jpeg)
+
+            def send_stream(self, broadcaster):
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.send_header("Cache-Control", "no-cache")
+                # Disable response buffering in the nginx reverse proxy
+                self.send_header("X-Accel-Buffering", "no")
+                self.end_headers()
+
+                with broadcaster.condition:
+                    broadcaster.num_clients = broadcaster.num_clients + 1
+                try:
+                    sequence = -1
+                    while not broadcaster.closed:
+                        # Send the latest frame, frames encoded while the client was writing are skipped
+                        new_sequence, jpeg = broadcaster.wait_for_frame(sequence)
+                        if jpeg is None or new_sequence == sequence:
+                            continue
+                        sequence = new_sequence
+                        self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                                         + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client disconnected
+                    pass
+                finally:
+                    with broadcaster.condition:
+                        broadcaster.num_clients = broadcaster.num_clients - 1
+
+        return StreamRequestHandler